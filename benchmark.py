@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+@author: P.Schwarz, F.Rosenthal
+
+Summary: Reproducible benchmark of the pipeline stages on synthetic data.
+
+A synthetic dataset with the layout of AudioMNIST (data/<speaker>/<digit>_<speaker>_<index>.wav, 48 kHz) is
+generated for every dataset size, so the benchmark needs neither the real dataset nor network access.
+Every stage is timed separately and the median of several repeats is saved to reports/benchmark.json.
+A run is compared against a stored baseline, and stages that got slower than the tolerance are reported.
+
+Before the stages, the import time of the classify only entry points is checked against a budget, and none
+of them may import the plotting and reporting libraries.
+
+Usage:
+    python benchmark.py [size ...]                 run and compare against reports/benchmark_baseline.json
+    python benchmark.py --save-baseline [size ...] run and store the results as the new baseline
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from scipy.io import wavfile
+
+from evaluation import evaluate, save_reports, save_json_report
+from spectrograms import create_all_spectrograms, stack_training, stack_test, get_filepaths, train_test_split
+from training import calc_svd, estimate_digit, classify_batch
+
+CLASSIFY_MODULES = ['predictor', 'number_classifier', 'server']
+HEAVY_MODULES = ['matplotlib', 'pandas', 'sklearn', 'scipy.signal']
+STAGES = ['feature_extraction', 'stacking', 'svd', 'classification_per_sample', 'classification_batched',
+          'report_generation']
+
+
+def generate_dataset(path, n_samples=500, n_speakers=10, fs=48000, min_duration=0.3, max_duration=1.0,
+                     random_seed=0):
+    """
+    Writes a synthetic dataset with the folder structure and naming of AudioMNIST.
+    Every digit is a harmonic tone with its own pitch and formant, varied per speaker and recording,
+    so the classes are separable but not trivially so.
+    :param path: Root folder of the dataset. One sub folder per speaker is created.
+    :param n_samples: Number of recordings, spread evenly over digits and speakers
+    :param n_speakers: Number of speakers
+    :param fs: Sample rate in Hz
+    :param min_duration: Shortest recording in seconds
+    :param max_duration: Longest recording in seconds
+    :param random_seed: Seed of the generator, the same seed writes the same files
+    :return: list of the written filepaths
+    """
+    rng = np.random.default_rng(random_seed)
+    speaker_pitch = rng.uniform(0.8, 1.25, n_speakers)
+    filepaths = []
+    for i in range(n_samples):
+        digit, speaker, index = i % 10, (i // 10) % n_speakers + 1, i // (10 * n_speakers)
+        folder = os.path.join(path, f"{speaker:02d}")
+        os.makedirs(folder, exist_ok=True)
+        n = int(fs * rng.uniform(min_duration, max_duration))
+        t = np.arange(n) / fs
+        pitch = (120 + 25 * digit) * speaker_pitch[speaker - 1] * rng.uniform(0.95, 1.05)
+        formant = 500 + 300 * digit
+        x = np.zeros(n)
+        for harmonic in range(1, 12):
+            x += np.exp(-((harmonic * pitch - formant) / 600) ** 2) * np.sin(2 * np.pi * harmonic * pitch * t)
+        x *= np.hanning(n) * rng.uniform(0.5, 1.0)
+        x += rng.normal(0, 0.02, n)
+        filepath = os.path.join(folder, f"{digit}_{speaker:02d}_{index}.wav")
+        wavfile.write(filepath, fs, (x / np.abs(x).max() * 16000).astype(np.int16))
+        filepaths.append(filepath)
+    return filepaths
+
+
+def time_stage(function, repeats):
+    """
+    Calls a function several times.
+    :param function: Function without arguments
+    :param repeats: Number of calls
+    :return: median run time in seconds, return value of the last call
+    """
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+    return float(np.median(durations)), result
+
+
+def benchmark_size(path, n_samples, k=20, repeats=3, n_jobs=1, per_sample_limit=100, svd_method='economy',
+                   random_seed=42):
+    """
+    Times all pipeline stages on one synthetic dataset.
+    :param path: Root folder for the synthetic dataset and the reports written during the benchmark
+    :param n_samples: Number of recordings
+    :param k: Number of singular values used in the classification
+    :param repeats: Number of repeats per stage, the median is reported
+    :param n_jobs: Number of worker processes of the feature extraction
+    :param per_sample_limit: Maximal number of test samples classified one by one
+    :param svd_method: SVD method used in training
+    :param random_seed: Seed of the dataset and the train test split
+    :return: list with one result dict per stage
+    """
+    data_path = os.path.join(path, "data") + "/"
+    generate_dataset(data_path, n_samples, random_seed=random_seed)
+    filepaths = sorted(get_filepaths(data_path))
+
+    seconds = {}
+    seconds['feature_extraction'], spec_dict = time_stage(
+        lambda: create_all_spectrograms(filepaths, n_jobs=n_jobs), repeats)
+    train_set, test_set = train_test_split(list(spec_dict['specs'].keys()), test_size=0.25,
+                                           random_state=random_seed)
+    seconds['stacking'], (train_stack, test_matrix) = time_stage(
+        lambda: (stack_training(spec_dict, train_set), stack_test(spec_dict, test_set)), repeats)
+    seconds['svd'], svd_list = time_stage(
+        lambda: calc_svd(train_stack, 10, method=svd_method, k_max=k, random_seed=random_seed), repeats)
+
+    n_single = min(per_sample_limit, test_matrix.shape[1])
+    duration, _ = time_stage(
+        lambda: [estimate_digit(svd_list, k, test_matrix[:, i]) for i in range(n_single)], repeats)
+    seconds['classification_per_sample'] = duration * test_matrix.shape[1] / n_single
+    seconds['classification_batched'], (predictions, used_k, residuals) = time_stage(
+        lambda: classify_batch(svd_list, k, test_matrix), repeats)
+
+    actual = [spec_dict['specs'][i]['digit'] for i in test_set]
+    report_dir = os.path.join(path, "reports")
+
+    def reports():
+        evaluation = evaluate(used_k, test_set, predictions, actual, residuals, 0)
+        save_reports([evaluation], report_dir)
+        save_json_report(evaluation, os.path.join(report_dir, f"number_metrics_{len(test_set)}_{used_k}.json"))
+        return evaluation
+
+    seconds['report_generation'], evaluation = time_stage(reports, repeats)
+    print(f"{n_samples} samples: error rate {evaluation['error_rate'][-1] * 100:.2f} % with k={used_k}")
+    return [{'size': n_samples,
+             'stage': stage,
+             'seconds': seconds[stage],
+             'per_sample_ms': seconds[stage] / n_samples * 1000} for stage in STAGES]
+
+
+def measure_import(module, repeats=3):
+    """
+    Imports a module in fresh interpreters.
+    :param module: Name of the module
+    :param repeats: Number of interpreters started, the fastest import is reported
+    :return: import time in seconds, list of the heavy modules loaded by the import
+    """
+    code = ("import json, sys, time\n"
+            "start = time.perf_counter()\n"
+            f"import {module}\n"
+            "print(json.dumps([time.perf_counter() - start, "
+            f"[name for name in {HEAVY_MODULES!r} if name in sys.modules]]))")
+    durations = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        duration, loaded = json.loads(output.splitlines()[-1])
+        durations.append(duration)
+    return min(durations), loaded
+
+
+def check_import_budget(modules=None, budget=1.0, repeats=3):
+    """
+    Checks that the classify only entry points import within the time budget and without the heavy modules.
+    :param modules: Names of the modules. Defaults to CLASSIFY_MODULES.
+    :param budget: Maximal import time in seconds
+    :param repeats: Number of interpreters started per module
+    :return: list of the violations as messages
+    """
+    violations = []
+    for module in modules or CLASSIFY_MODULES:
+        duration, loaded = measure_import(module, repeats)
+        print(f"import {module}: {duration:.3f} s (budget {budget:.3f} s)")
+        if duration > budget:
+            violations.append(f"import {module} took {duration:.3f} s, the budget is {budget:.3f} s")
+        if loaded:
+            violations.append(f"import {module} loads {', '.join(loaded)}")
+    return violations
+
+
+def compare_baseline(results, baseline, tolerance=0.25, min_seconds=0.005):
+    """
+    Compares benchmark results with a baseline.
+    :param results: List of result dicts as returned by benchmark_size
+    :param baseline: List of result dicts of the baseline run
+    :param tolerance: Allowed relative slowdown of a stage
+    :param min_seconds: Stages faster than this in both runs are not compared, their timings are mostly noise
+    :return: list of (size, stage, baseline seconds, seconds) of every regressed stage
+    """
+    reference = {(result['size'], result['stage']): result['seconds'] for result in baseline}
+    regressions = []
+    for result in results:
+        key = (result['size'], result['stage'])
+        if key not in reference or max(reference[key], result['seconds']) < min_seconds:
+            continue
+        result['baseline_seconds'] = reference[key]
+        result['ratio'] = result['seconds'] / reference[key]
+        if result['ratio'] > 1 + tolerance:
+            regressions.append((*key, reference[key], result['seconds']))
+    return regressions
+
+
+def run_benchmark(sizes=None, k=20, repeats=3, n_jobs=1, report_path="reports/benchmark.json",
+                  baseline_path="reports/benchmark_baseline.json", save_baseline=False, tolerance=0.25):
+    """
+    Benchmarks all pipeline stages at several dataset sizes, saves the results and compares them to the baseline.
+
+    :param sizes: Numbers of recordings of the synthetic datasets. Default is [200, 1000].
+    :param k: Number of singular values used in the classification
+    :param repeats: Number of repeats per stage, the median is reported
+    :param n_jobs: Number of worker processes of the feature extraction
+    :param report_path: Filepath of the json results
+    :param baseline_path: Filepath of the json baseline
+    :param save_baseline: If set to true, the results are stored as the new baseline instead of being compared
+    :param tolerance: Allowed relative slowdown of a stage
+    :return: results, list of regressed stages
+    """
+    if sizes is None:
+        sizes = [200, 1000]
+    results = []
+    for n_samples in sizes:
+        path = tempfile.mkdtemp(prefix="benchmark_")
+        try:
+            results.extend(benchmark_size(path, n_samples, k=k, repeats=repeats, n_jobs=n_jobs))
+        finally:
+            shutil.rmtree(path)
+
+    regressions = []
+    if not save_baseline and os.path.isfile(baseline_path):
+        with open(baseline_path) as f:
+            regressions = compare_baseline(results, json.load(f)['results'], tolerance)
+
+    print(f"{'size':>6} {'stage':<27} {'seconds':>10} {'ms/sample':>10} {'baseline':>10}")
+    for result in results:
+        baseline = f"{result['ratio']:9.2f}x" if 'ratio' in result else f"{'-':>10}"
+        print(f"{result['size']:>6} {result['stage']:<27} {result['seconds']:>10.4f} "
+              f"{result['per_sample_ms']:>10.4f} {baseline}")
+
+    run = {'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+           'k': k,
+           'repeats': repeats,
+           'n_jobs': n_jobs,
+           'numpy': np.__version__,
+           'results': results}
+    os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+    with open(baseline_path if save_baseline else report_path, 'w') as f:
+        json.dump(run, f, indent=2)
+    for size, stage, before, after in regressions:
+        print(f"Regression: {stage} with {size} samples took {after:.4f} s instead of {before:.4f} s")
+    return results, regressions
+
+
+if __name__ == '__main__':
+    arguments = [argument for argument in sys.argv[1:] if argument != '--save-baseline']
+    import_violations = check_import_budget()
+    _, found_regressions = run_benchmark(sizes=[int(size) for size in arguments] or None,
+                                         save_baseline='--save-baseline' in sys.argv)
+    for violation in import_violations:
+        print(f"Import budget: {violation}")
+    sys.exit(1 if found_regressions or import_violations else 0)
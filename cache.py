@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+@author: P.Schwarz, F.Rosenthal
+
+Summary: Content addressed cache for the spectrogram and SVD artifacts.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+
+def fingerprint_files(filepaths):
+    """
+    Hashes a list of files by their paths, sizes and modification times.
+    :param filepaths: List of filepaths
+    :return: hex digest identifying the dataset
+    """
+    digest = hashlib.sha256()
+    for filepath in sorted(filepaths):
+        stat = os.stat(filepath)
+        digest.update(f"{filepath}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def cache_key(**params):
+    """
+    Builds a cache key from the parameters an artifact depends on.
+    :param params: json serializable parameters. Keys of other artifacts can be passed to chain dependencies.
+    :return: hex digest of the parameters
+    """
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:20]
+
+
+def _entry_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path)
+
+
+class CacheManager:
+    """
+    Manages artifacts in a cache directory by content addressed keys.
+    Every artifact is a file or directory named <name>_<key>. Its modification time is used as last access time
+    for evicting the least recently used artifacts once the cache exceeds max_bytes.
+    Artifacts are written to a staging path first and moved to their final path by commit(), so an interrupted
+    run never leaves an incomplete artifact that lookup() would report as a hit.
+    """
+
+    def __init__(self, cache_dir, max_bytes=None):
+        """
+        :param cache_dir: Directory of the cache. It will be created if it does not exist.
+        :param max_bytes: Size limit of the cache directory. No limit if None.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, name, key):
+        """
+        :param name: Name of the artifact type, e.g. 'spectrograms'
+        :param key: Key as returned by cache_key
+        :return: path of the artifact
+        """
+        return os.path.join(self.cache_dir, f"{name}_{key}")
+
+    def staging_path(self, name, key):
+        """
+        Returns the path an artifact is written to before commit(). Leftovers of an interrupted run are removed.
+        :param name: Name of the artifact type, e.g. 'spectrograms'
+        :param key: Key as returned by cache_key
+        :return: staging path of the artifact
+        """
+        path = self.path(name, key) + '.tmp'
+        if os.path.exists(path):
+            self._remove(path)
+        return path
+
+    def lookup(self, name, key, validate=None):
+        """
+        Looks up an artifact and counts a hit or miss.
+        :param name: Name of the artifact type
+        :param key: Key as returned by cache_key
+        :param validate: Optional function returning False for an incomplete artifact, which is then removed
+            and counted as a miss
+        :return: path of the artifact if it is cached, otherwise None
+        """
+        path = self.path(name, key)
+        if os.path.exists(path) and validate is not None and not validate(path):
+            print(f"Removing incomplete cache entry {os.path.basename(path)}")
+            self._remove(path)
+        if os.path.exists(path):
+            self.stats['hits'] += 1
+            os.utime(path)
+            return path
+        self.stats['misses'] += 1
+        return None
+
+    def commit(self, name, key):
+        """
+        Moves an artifact that has been written to self.staging_path(name, key) to its final path at once and
+        enforces the size limit. The committed artifact itself is never evicted.
+        :param name: Name of the artifact type
+        :param key: Key as returned by cache_key
+        :return: path of the artifact
+        """
+        path = self.path(name, key)
+        if os.path.exists(path):
+            # written by a concurrent run with the same key, the contents are identical
+            self._remove(path + '.tmp')
+        else:
+            os.replace(path + '.tmp', path)
+        os.utime(path)
+        self.evict(keep=path)
+        return path
+
+    def entries(self):
+        """
+        :return: list of (path, size in bytes, last access time) of all artifacts, least recently used first
+        """
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, filename)
+            entries.append((path, _entry_size(path), os.path.getmtime(path)))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def size(self):
+        """
+        :return: total size of the cache in bytes
+        """
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used artifacts until the cache fits into max_bytes.
+        :param keep: Path that will not be removed
+        """
+        if self.max_bytes is None:
+            return
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            self._remove(path)
+            self.stats['evictions'] += 1
+            total -= size
+
+    def invalidate(self, name=None, key=None):
+        """
+        Removes artifacts explicitly.
+        :param name: Only artifacts of this type are removed. All types if None.
+        :param key: Only the artifact with this key is removed. All keys if None.
+        :return: number of removed artifacts
+        """
+        removed = 0
+        for path, _, _ in self.entries():
+            entry_name, _, entry_key = os.path.basename(path).rpartition("_")
+            if (name is None or entry_name == name) and (key is None or entry_key == key):
+                self._remove(path)
+                removed += 1
+        return removed
+
+    def report(self):
+        """
+        :return: string summarizing hits, misses, evictions and size of the cache
+        """
+        return (f"Cache: {self.stats['hits']} hits, {self.stats['misses']} misses, "
+                f"{self.stats['evictions']} evictions, {self.size() / (1024 * 1024):.1f} MB")
+
+    @staticmethod
+    def _remove(path):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    cache = CacheManager(os.path.join(os.getcwd(), "cache"))
+    for path, size, last_access in cache.entries():
+        print(f"{time.ctime(last_access)}\t{size / (1024 * 1024):8.1f} MB\t{os.path.basename(path)}")
+    print(cache.report())
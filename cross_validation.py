@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+@author: F.Rosenthal, P.Schwarz
+
+Summary: Speaker grouped cross-validation of the digit classifier.
+
+The folds are grouped by speaker, so no speaker is part of the training and the test data of the same fold.
+Every fold is trained and evaluated in its own worker process. All workers open the same memory mapped
+spectrogram store instead of receiving a copy of the spectrograms.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import GroupKFold
+
+from cache import CacheManager
+from number_classifier import get_spectrogram_store
+from spectrograms import get_filepaths, load_spectrogram_store, stack_training, stack_test
+from training import calc_svd, classify_batch_sweep
+
+
+def speaker_folds(spec_dict, n_folds=5):
+    """
+    Splits the samples of a spectrogram store into folds grouped by speaker.
+    :param spec_dict: Spectrogram data as returned by load_spectrogram_store
+    :param n_folds: Number of folds
+    :return: list of (train ids, test ids) per fold
+    """
+    records = spec_dict['specs']
+    ids = np.asarray(records.ids)
+    folds = GroupKFold(n_splits=n_folds).split(ids, groups=records.speakers)
+    return [(ids[train].tolist(), ids[test].tolist()) for train, test in folds]
+
+
+def evaluate_fold(store_dir, train_set, test_set, k_list, svd_method='economy', k_max=None, chunk_size=512):
+    """
+    Trains and tests the classifier on one fold.
+    :param store_dir: Directory of the spectrogram store. It is memory mapped, so workers share its pages.
+    :param train_set: ids of the training samples
+    :param test_set: ids of the test samples
+    :param k_list: Values of k to evaluate
+    :param svd_method: SVD method used in training
+    :param k_max: Number of singular vectors stored per class. Defaults to max(k_list).
+    :param chunk_size: Number of test samples classified together
+    :return: dict with the error rate for every k
+    """
+    content = load_spectrogram_store(store_dir)
+    train_stack = stack_training(spec_dict=content, train_set=train_set)
+    svd_list = calc_svd(train_stack, 10, method=svd_method, k_max=max(k_list) if k_max is None else k_max)
+    del train_stack
+    test_matrix = stack_test(spec_dict=content, test_set=test_set)
+    actual = content['specs'].digits[content['specs'].rows(test_set)]
+    results = classify_batch_sweep(svd_list, k_list, test_matrix, chunk_size=chunk_size)
+    return {k: float(np.mean(results[k][0] != actual)) for k in k_list}
+
+
+def cross_validate(k_list=None, path="data/", n_folds=5, n_jobs=None, svd_method='economy', k_max=None,
+                   cutoff_value=6000, dtype='float32', chunk_size=512):
+    """
+    Runs a speaker grouped cross-validation with the folds evaluated in parallel worker processes
+    and saves the per-fold and mean error rates to reports/cross_validation.csv.
+
+    :param k_list: Values of k to evaluate. Default is [10, 50, 100].
+    :param path: Path to the dataset. Default is 'data/'.
+    :param n_folds: Number of folds
+    :param n_jobs: Number of worker processes. Defaults to n_folds.
+    :param svd_method: SVD method used in training
+    :param k_max: Number of singular vectors stored per class. Defaults to max(k_list).
+    :param cutoff_value: Frequencies above this value are cut off the spectrograms
+    :param dtype: Data type of spectrograms, SVD and residuals
+    :param chunk_size: Number of test samples classified together
+    :return: DataFrame with one row per fold plus the mean and standard deviation and one column per k
+    """
+    if k_list is None:
+        k_list = [10, 50, 100]
+    cache = CacheManager(os.path.join(os.getcwd(), "cache"))
+    store_dir, _ = get_spectrogram_store(cache, get_filepaths(path), cutoff_value=cutoff_value, dtype=dtype)
+    folds = speaker_folds(load_spectrogram_store(store_dir), n_folds)
+
+    print(f"Evaluating {n_folds} speaker grouped folds...")
+    with ProcessPoolExecutor(max_workers=n_jobs or n_folds) as pool:
+        futures = [pool.submit(evaluate_fold, store_dir, train_set, test_set, k_list, svd_method, k_max, chunk_size)
+                   for train_set, test_set in folds]
+        error_rates = [future.result() for future in futures]
+
+    report = pd.DataFrame(error_rates, index=[f"fold {i}" for i in range(n_folds)])
+    report.columns = [f"k={k}" for k in k_list]
+    report.loc['mean'] = report.iloc[:n_folds].mean()
+    report.loc['std'] = report.iloc[:n_folds].std()
+    print(report)
+    os.makedirs(os.path.join(os.getcwd(), "reports"), exist_ok=True)
+    report.to_csv('reports/cross_validation.csv')
+    return report
+
+
+if __name__ == "__main__":
+    cross_validate(path="data/")
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+@author: P.Schwarz, F.Rosenthal
+
+Summary: Evaluation results held in NumPy arrays and their reports.
+
+An evaluation is a dict of arrays with one entry per test sample:
+
+    evaluation = {'k': int,                      # number of singular values used
+                  'ids': np.array,               # ids of the test samples in the spectrogram data
+                  'estimated': np.array,         # predicted digits
+                  'actual': np.array,            # actual digits
+                  'residuals': np.array,         # residual matrix (n_samples x n_classes)
+                  'duration_ns': np.array,       # classification time per sample in nanoseconds, the batch mean
+                                                 # if the samples have been timed together
+                  'error_rate': np.array}        # error rate over the first i + 1 samples
+"""
+
+import os
+import time
+
+import numpy as np
+
+
+class RateLimitedLogger:
+    """
+    Prints progress messages at most once per interval, so logging does not slow down long loops.
+    """
+
+    def __init__(self, interval=1.0):
+        """
+        :param interval: Minimal time in seconds between two printed messages
+        """
+        self.interval = interval
+        self._last = None
+
+    def log(self, message, force=False):
+        """
+        Prints the message if the interval since the last printed message has passed.
+        :param message: Message to print
+        :param force: If true, the message is printed regardless of the interval
+        :return: True if the message has been printed
+        """
+        now = time.perf_counter()
+        if force or self._last is None or now - self._last >= self.interval:
+            print(message)
+            self._last = now
+            return True
+        return False
+
+
+def evaluate(k, ids, estimated, actual, residuals, duration_ns):
+    """
+    Collects the results of a classification run in preallocated arrays.
+    :param k: Number of singular values used
+    :param ids: ids of the test samples
+    :param estimated: Predicted digits
+    :param actual: Actual digits
+    :param residuals: Residual matrix (n_samples x n_classes)
+    :param duration_ns: Classification time in nanoseconds, either per sample or of the whole batch. The time of a
+        batch is stored as its mean per sample.
+    :return: evaluation dict
+    """
+    n_samples = len(actual)
+    evaluation = {'k': k,
+                  'ids': np.asarray(ids, dtype=np.int64),
+                  'estimated': np.asarray(estimated, dtype=np.int8),
+                  'actual': np.asarray(actual, dtype=np.int8),
+                  'residuals': np.asarray(residuals, dtype=np.float64),
+                  'duration_ns': np.empty(n_samples, dtype=np.int64)}
+    evaluation['duration_ns'][:] = duration_ns if np.ndim(duration_ns) else duration_ns // max(n_samples, 1)
+    incorrect = evaluation['estimated'] != evaluation['actual']
+    evaluation['error_rate'] = np.cumsum(incorrect) / np.arange(1, n_samples + 1)
+    return evaluation
+
+
+def log_samples(evaluation, logger):
+    """
+    Prints the results of the single samples through a rate limited logger.
+    :param evaluation: evaluation dict
+    :param logger: RateLimitedLogger
+    """
+    n_samples = len(evaluation['actual'])
+    for i in range(n_samples):
+        estimated, actual = evaluation['estimated'][i], evaluation['actual'][i]
+        logger.log(f"### Sample {i + 1} of {n_samples} under Test #\tPredicted class: {estimated}. "
+                   f"Actual class: {actual}. {'Success!' if estimated == actual else 'We will get it next time!'}",
+                   force=i == n_samples - 1)
+
+
+def to_metrics_dict(evaluation):
+    """
+    Converts an evaluation to the nested dict of the json reports, e.g. number_metrics_7500_1500.json.
+    :param evaluation: evaluation dict
+    :return: dict with 'samples', 'error_rate', 'used_EV' and the per sample 'results'
+    """
+    n_samples = len(evaluation['actual'])
+    results = {}
+    for i in range(n_samples):
+        results[i] = {'estimated': int(evaluation['estimated'][i]),
+                      'actual': int(evaluation['actual'][i]),
+                      'correct': bool(evaluation['estimated'][i] == evaluation['actual'][i]),
+                      'error rate': float(evaluation['error_rate'][i]),
+                      'duration': float(evaluation['duration_ns'][i] / 1e9),
+                      'residuals': evaluation['residuals'][i].tolist()}
+    return {'samples': n_samples,
+            'error_rate': float(evaluation['error_rate'][-1]),
+            'used_EV': evaluation['k'],
+            'results': results}
+
+
+def save_json_report(evaluation, path):
+    """
+    Writes an evaluation in the json format of the former reports, e.g. number_metrics_7500_1500.json.
+    :param evaluation: evaluation dict
+    :param path: Filepath of the report
+    """
+    import pandas as pd
+    pd.DataFrame.from_dict(to_metrics_dict(evaluation)).to_json(path)
+
+
+def save_reports(evaluations, report_dir="reports"):
+    """
+    Writes all evaluations of a run at once:
+        - number_metrics_<samples>.npz with the arrays of every k, prefixed by 'k<k>_',
+        - number_metrics_<samples>.csv with one row per sample and k and a single header,
+        - one summary row per k appended to number_metrics.csv, whose header is only written on creation.
+    :param evaluations: List of evaluation dicts
+    :param report_dir: Directory of the reports
+    :return: path of the npz report
+    """
+    import pandas as pd
+    os.makedirs(report_dir, exist_ok=True)
+    n_samples = len(evaluations[0]['actual'])
+    arrays = {f"k{evaluation['k']}_{key}": value for evaluation in evaluations
+              for key, value in evaluation.items() if key != 'k'}
+    npz_path = os.path.join(report_dir, f"number_metrics_{n_samples}.npz")
+    np.savez_compressed(npz_path, **arrays)
+
+    frames = []
+    for evaluation in evaluations:
+        frame = pd.DataFrame({'k': evaluation['k'],
+                              'sample': np.arange(n_samples),
+                              'id': evaluation['ids'],
+                              'estimated': evaluation['estimated'],
+                              'actual': evaluation['actual'],
+                              'error_rate': evaluation['error_rate'],
+                              'duration_ns': evaluation['duration_ns']})
+        residuals = pd.DataFrame(evaluation['residuals'],
+                                 columns=[f"residual_{i}" for i in range(evaluation['residuals'].shape[1])])
+        frames.append(pd.concat((frame, residuals), axis=1))
+    pd.concat(frames).to_csv(os.path.join(report_dir, f"number_metrics_{n_samples}.csv"), index=False)
+
+    summary_path = os.path.join(report_dir, "number_metrics.csv")
+    summary = pd.DataFrame({'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+                            'samples': n_samples,
+                            'k': [evaluation['k'] for evaluation in evaluations],
+                            'error_rate': [evaluation['error_rate'][-1] for evaluation in evaluations],
+                            'mean_duration_ns': [evaluation['duration_ns'].mean() for evaluation in evaluations]})
+    summary.to_csv(summary_path, mode="a", index=False, header=not os.path.isfile(summary_path))
+    return npz_path
+
+
+def load_reports(npz_path):
+    """
+    Reads the evaluations written by save_reports.
+    :param npz_path: Filepath of the npz report
+    :return: dict with k as keys and evaluation dicts as values
+    """
+    evaluations = {}
+    with np.load(npz_path) as arrays:
+        for name in arrays.files:
+            prefix, _, key = name.partition("_")
+            k = int(prefix[1:])
+            evaluations.setdefault(k, {'k': k})[key] = arrays[name]
+    return evaluations
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+@author: P.Schwarz, F.Rosenthal
+
+Summary: Grid search over the cutoff frequency, the spectrogram window and k.
+
+Spectrograms are calculated once per window with the highest cutoff and cached. Lower cutoffs are derived by
+truncating the frequency bins of the cached spectrograms. Per configuration, the bases are trained once with
+k_max = max(k_list) and reused for every smaller k.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from cache import CacheManager
+from number_classifier import get_spectrogram_store
+from spectrograms import get_filepaths, load_spectrogram_store, train_test_split, cutoff_to_index
+from training import calc_svd, classify_batch
+
+
+def truncate_cutoff(matrix, cutoff_index, max_shape, new_cutoff_index):
+    """
+    Derives flattened spectrograms with a lower cutoff by dropping frequency bins.
+    :param matrix: Flattened spectrograms, one per row, with cutoff_index frequency bins of max_shape frames
+    :param cutoff_index: Number of frequency bins in matrix
+    :param max_shape: Number of time frames in matrix
+    :param new_cutoff_index: Number of frequency bins to keep
+    :return: matrix of the flattened spectrograms with new_cutoff_index frequency bins
+    """
+    return matrix.reshape(len(matrix), cutoff_index, max_shape)[:, :new_cutoff_index, :].reshape(len(matrix), -1)
+
+
+def evaluate_config(store_dir, cutoff_value, train_set, test_set, k_list, svd_method='economy', chunk_size=512):
+    """
+    Trains and tests one combination of spectrogram window and cutoff for all values of k.
+    :param store_dir: Directory of the spectrogram store calculated with the highest cutoff
+    :param cutoff_value: Cutoff frequency of this configuration
+    :param train_set: ids of the training samples
+    :param test_set: ids of the test samples
+    :param k_list: Values of k to evaluate
+    :param svd_method: SVD method used in training
+    :param chunk_size: Number of test samples classified together
+    :return: list with one result dict per k
+    """
+    content = load_spectrogram_store(store_dir)
+    records = content['specs']
+    cutoff_index = cutoff_to_index(cutoff_value, content['nperseg'])
+
+    def features(ids):
+        rows = np.sort(records.rows(ids))
+        if cutoff_index == content['cutoff_index']:
+            return np.asarray(content['matrix'][rows]), records.digits[rows]
+        return truncate_cutoff(content['matrix'][rows], content['cutoff_index'], content['max_shape'],
+                               cutoff_index), records.digits[rows]
+
+    train_matrix, train_digits = features(train_set)
+    train_stack = {digit: np.asfortranarray(train_matrix[train_digits == digit].T) for digit in range(10)}
+    del train_matrix
+    start = time.perf_counter()
+    svd_list = calc_svd(train_stack, 10, method=svd_method, k_max=max(k_list))
+    training_time = time.perf_counter() - start
+    del train_stack
+
+    test_matrix, actual = features(test_set)
+    test_matrix = np.asfortranarray(test_matrix.T)
+    results = []
+    for k in k_list:
+        start = time.perf_counter()
+        predictions, used_k, _ = classify_batch(svd_list, k, test_matrix, chunk_size=chunk_size)
+        latency = (time.perf_counter() - start) / len(actual)
+        results.append({'cutoff_value': cutoff_value,
+                        'nperseg': content['nperseg'],
+                        'noverlap': content['noverlap'],
+                        'n_features': test_matrix.shape[0],
+                        'k': used_k,
+                        'error_rate': float(np.mean(predictions != actual)),
+                        'latency_ms': latency * 1000,
+                        'model_MB': 10 * test_matrix.shape[0] * used_k * test_matrix.itemsize / (1024 * 1024),
+                        'training_s': training_time})
+    return results
+
+
+def grid_search(cutoff_values=None, windows=None, k_list=None, path="data/", n_jobs=None, svd_method='economy',
+                dtype='float32', split_ratio=0.25, random_seed=42):
+    """
+    Evaluates all combinations of cutoff frequency, spectrogram window and k in parallel worker processes
+    and saves the results ranked by error rate and latency to reports/grid_search.csv.
+
+    :param cutoff_values: Cutoff frequencies in Hz. Default is [3000, 4500, 6000].
+    :param windows: List of (nperseg, noverlap) tuples. noverlap may be None. Default is [(256, None)].
+    :param k_list: Values of k to evaluate. Default is [10, 50, 100].
+    :param path: Path to the dataset. Default is 'data/'.
+    :param n_jobs: Number of worker processes. Defaults to the number of CPUs.
+    :param svd_method: SVD method used in training
+    :param dtype: Data type of spectrograms, SVD and residuals
+    :param split_ratio: Share of the samples used for testing
+    :param random_seed: Seed of the train test split
+    :return: DataFrame with one row per configuration, best configuration first
+    """
+    if cutoff_values is None:
+        cutoff_values = [3000, 4500, 6000]
+    if windows is None:
+        windows = [(256, None)]
+    if k_list is None:
+        k_list = [10, 50, 100]
+    cache = CacheManager(os.path.join(os.getcwd(), "cache"))
+    filepaths = get_filepaths(path)
+
+    # one spectrogram store per window, calculated with the highest cutoff
+    stores = {}
+    for nperseg, noverlap in windows:
+        stores[(nperseg, noverlap)], _ = get_spectrogram_store(cache, filepaths, n_jobs=n_jobs or 1,
+                                                               cutoff_value=max(cutoff_values), dtype=dtype,
+                                                               nperseg=nperseg, noverlap=noverlap)
+    indices = list(load_spectrogram_store(next(iter(stores.values())))['specs'].keys())
+    train_set, test_set = train_test_split(indices, test_size=split_ratio, random_state=random_seed)
+
+    configurations = list(product(stores.values(), cutoff_values))
+    print(f"Evaluating {len(configurations)} configurations with {len(k_list)} values of k...")
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        futures = [pool.submit(evaluate_config, store_dir, cutoff_value, train_set, test_set, k_list, svd_method)
+                   for store_dir, cutoff_value in configurations]
+        results = [result for future in futures for result in future.result()]
+
+    report = (pd.DataFrame(results)
+              .sort_values(['error_rate', 'latency_ms', 'model_MB'])
+              .reset_index(drop=True))
+    print(report.to_string())
+    os.makedirs(os.path.join(os.getcwd(), "reports"), exist_ok=True)
+    report.to_csv('reports/grid_search.csv', index=False)
+    return report
+
+
+def compare_time_layouts(layouts=None, k_list=None, path="data/", cutoff_value=6000, n_jobs=None,
+                         svd_method='economy', dtype='float32', split_ratio=0.25, random_seed=42):
+    """
+    Benchmarks fixed length feature layouts against zero padding to the longest recording.
+    The feature dimension, training time, latency and error rate of every layout are saved to
+    reports/time_layouts.csv.
+
+    :param layouts: List of dicts with the time_layout, n_frames, log_magnitude and n_bands arguments of
+        create_all_spectrograms. Defaults to zero padding, resampling and pooling to 32 frames
+        and pooling with log magnitudes and 16 frequency bands.
+    :param k_list: Values of k to evaluate. Default is [10, 50, 100].
+    :param path: Path to the dataset. Default is 'data/'.
+    :param cutoff_value: Cutoff frequency in Hz
+    :param n_jobs: Number of worker processes. Defaults to the number of CPUs.
+    :param svd_method: SVD method used in training
+    :param dtype: Data type of spectrograms, SVD and residuals
+    :param split_ratio: Share of the samples used for testing
+    :param random_seed: Seed of the train test split
+    :return: DataFrame with one row per layout and k
+    """
+    if layouts is None:
+        layouts = [{'time_layout': 'pad'},
+                   {'time_layout': 'resample', 'n_frames': 32},
+                   {'time_layout': 'pool', 'n_frames': 32},
+                   {'time_layout': 'pool', 'n_frames': 32, 'log_magnitude': True, 'n_bands': 16}]
+    if k_list is None:
+        k_list = [10, 50, 100]
+    cache = CacheManager(os.path.join(os.getcwd(), "cache"))
+    filepaths = get_filepaths(path)
+    stores = [get_spectrogram_store(cache, filepaths, n_jobs=n_jobs or 1, cutoff_value=cutoff_value, dtype=dtype,
+                                    **layout)[0] for layout in layouts]
+    indices = list(load_spectrogram_store(stores[0])['specs'].keys())
+    train_set, test_set = train_test_split(indices, test_size=split_ratio, random_state=random_seed)
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        futures = [pool.submit(evaluate_config, store_dir, cutoff_value, train_set, test_set, k_list, svd_method)
+                   for store_dir in stores]
+        results = [dict(result, layout=str(layout)) for layout, future in zip(layouts, futures)
+                   for result in future.result()]
+
+    report = pd.DataFrame(results)[['layout', 'n_features', 'k', 'error_rate', 'latency_ms', 'training_s',
+                                    'model_MB']]
+    padded = report[report['layout'] == str(layouts[0])].set_index('k')
+    report['speedup'] = [padded.loc[k, 'latency_ms'] / latency for k, latency in zip(report['k'], report['latency_ms'])]
+    print(report.to_string())
+    os.makedirs(os.path.join(os.getcwd(), "reports"), exist_ok=True)
+    report.to_csv('reports/time_layouts.csv', index=False)
+    return report
+
+
+if __name__ == "__main__":
+    grid_search(windows=[(256, None), (512, 64)], path="data/")
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+@author: P.Schwarz, F.Rosenthal
+
+Summary: Incremental training of a saved model with new recordings, e.g. of new speakers.
+"""
+
+import numpy as np
+
+from model import load_model, save_model
+from predictor import DigitPredictor
+from spectrograms import parse_filename
+from training import update_svd, subspace_drift, calc_svd
+
+HEADER_BLOCKS = ('n_classes', 'n_features', 'k_max', 'ranks', 'dtype', 'singular_values', 'version')
+
+
+def update_model(model, new_stack, out_path, k_max=None):
+    """
+    Updates the class bases of a model with new training columns and saves the result.
+    The cost depends on the number of new columns and k_max only, not on the old training data.
+    :param model: Filepath of a model or a model as returned by model.load_model. It needs singular values.
+    :param new_stack: dict with digits as keys and new column wise stacked spectrograms as values
+    :param out_path: Filepath of the updated model. May be the path of the old model.
+    :param k_max: Number of basis vectors kept per class. Defaults to the k_max of the model.
+    :return: the updated model as returned by model.load_model
+    """
+    if isinstance(model, str):
+        model = load_model(model, mmap=False)
+    if model['singular_values'] is None:
+        raise ValueError("The model has no singular values and can not be updated.")
+    if k_max is None:
+        k_max = model['k_max']
+    svd_list = []
+    sv_list = []
+    for i, rank in enumerate(model['ranks']):
+        # zero singular values belong to padding columns, e.g. in models saved with the padded rank
+        rank = int(np.count_nonzero(model['singular_values'][i, :rank]))
+        u = np.array(model['svd_list'][i][:, :rank])
+        s = model['singular_values'][i, :rank]
+        if i in new_stack:
+            u, s = update_svd(u, s, new_stack[i].astype(u.dtype, copy=False), k_max=k_max)
+        svd_list.append(u[:, :k_max])
+        sv_list.append(s[:k_max])
+    meta = {key: value for key, value in model.items()
+            if key not in HEADER_BLOCKS + ('bases', 'svd_list')}
+    meta['n_updates'] = meta.get('n_updates', 0) + 1
+    # the model may be memory mapped from out_path, so all data is copied before writing
+    save_model(out_path, svd_list, k_max=k_max, singular_values=sv_list, **meta)
+    return load_model(out_path)
+
+
+def add_recordings(model, filepaths, out_path, k_max=None, batch_size=256):
+    """
+    Adds recordings named digit_speaker_index.wav to a model.
+    The spectrograms are calculated with the feature parameters of the model.
+    :param model: Filepath of a model or a model as returned by model.load_model
+    :param filepaths: Filepaths of the new recordings
+    :param out_path: Filepath of the updated model
+    :param k_max: Number of basis vectors kept per class. Defaults to the k_max of the model.
+    :param batch_size: Number of recordings per class added in one update
+    :return: the updated model as returned by model.load_model
+    """
+    if isinstance(model, str):
+        model = load_model(model, mmap=False)
+    predictor = DigitPredictor(model)
+    by_digit = {}
+    for filepath in filepaths:
+        digit, _ = parse_filename(filepath)
+        by_digit.setdefault(digit, []).append(filepath)
+    for start in range(0, max(len(paths) for paths in by_digit.values()), batch_size):
+        new_stack = {digit: np.column_stack([predictor.features(path) for path in paths[start:start + batch_size]])
+                     for digit, paths in by_digit.items() if len(paths) > start}
+        model = update_model(model, new_stack, out_path, k_max=k_max)
+        predictor = DigitPredictor(model)
+    return model
+
+
+def check_drift(model, train_stack, k=None, tolerance=0.1, method='economy'):
+    """
+    Compares the bases of an incrementally updated model to a full recomputation on all training data.
+    Run it periodically, e.g. after every few updates, and retrain the model if the drift exceeds the tolerance.
+    :param model: Filepath of a model or a model as returned by model.load_model
+    :param train_stack: dict with digits as keys and all column wise stacked training spectrograms as values
+    :param k: Number of basis vectors compared. Defaults to the k_max of the model.
+    :param tolerance: Largest accepted sine of the principal angles between both subspaces
+    :param method: SVD method of the full recomputation
+    :return: list with the drift of every class, True if all classes are within the tolerance
+    """
+    if isinstance(model, str):
+        model = load_model(model)
+    k = model['k_max'] if k is None else k
+    reference, reference_sv = calc_svd(train_stack, model['n_classes'], method=method, k_max=k,
+                                       return_singular_values=True)
+    # the zero columns of padded bases are not compared, only the true ranks of both bases
+    drifts = [subspace_drift(model['svd_list'][i], reference[i], min(k, model['ranks'][i], len(reference_sv[i])))
+              for i in range(model['n_classes'])]
+    within_tolerance = max(drifts) <= tolerance
+    print(f"Maximal basis drift {max(drifts):.4f} after {model.get('n_updates', 0)} updates "
+          f"({'within' if within_tolerance else 'exceeds'} tolerance {tolerance}).")
+    return drifts, within_tolerance
+
+
+if __name__ == '__main__':
+    import sys
+    from predictor import iter_wav_files
+    add_recordings(sys.argv[1], list(iter_wav_files(sys.argv[2])), sys.argv[3] if len(sys.argv) > 3 else sys.argv[1])
+    print("Model has been updated.")
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+@author: P.Schwarz, F.Rosenthal
+
+Summary: Named spans around the pipeline stages.
+
+Every span records its wall time, CPU time, peak traced memory and the bytes of the arrays counted in it.
+Spans are off by default. Then span() returns one shared context manager that does nothing, so instrumented code
+pays a function call per span and nothing else. After enable(), the finished spans are collected and can be
+saved as a trace in the Chrome trace event format (chrome://tracing, ui.perfetto.dev) and summarized per name.
+
+    enable()
+    with span('svd', subset=i):
+        u, s, _ = linalg.svd(stack)
+        count_bytes(u, s)
+    dump_trace('reports/trace.json')
+    print(summary())
+"""
+
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+_NO_SPAN = nullcontext()
+_state = {'enabled': False, 'memory': False, 'origin': 0, 'spans': [], 'stack': []}
+_lock = threading.Lock()
+
+
+def enable(memory=True):
+    """
+    Starts collecting spans. Spans collected before are discarded.
+    :param memory: If true, tracemalloc is started to record the peak memory of every span. It slows down
+        allocations, so timings taken with memory tracing are higher than without.
+    """
+    _state.update(enabled=True, memory=memory, origin=time.perf_counter_ns(), spans=[], stack=[])
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    """
+    Stops collecting spans. The collected spans are kept until the next enable().
+    """
+    if _state['memory'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _state.update(enabled=False, memory=False)
+
+
+def is_enabled():
+    """
+    :return: True if spans are collected
+    """
+    return _state['enabled']
+
+
+class _Span:
+    """
+    Context manager measuring one span.
+    """
+
+    def __init__(self, name, attributes):
+        self.record = {'name': name, 'args': attributes, 'bytes': 0}
+        self._peak = 0
+
+    def __enter__(self):
+        record = self.record
+        record['depth'] = len(_state['stack'])
+        if _state['memory']:
+            current, peak = tracemalloc.get_traced_memory()
+            # the peak is reset for this span, the parents keep the peak reached so far
+            for parent in _state['stack']:
+                parent._peak = max(parent._peak, peak)
+            tracemalloc.reset_peak()
+            record['memory_start'] = current
+        _state['stack'].append(self)
+        record['cpu_start'] = time.process_time_ns()
+        record['start'] = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter_ns()
+        cpu_end = time.process_time_ns()
+        record = self.record
+        record['wall_s'] = (end - record['start']) / 1e9
+        record['cpu_s'] = (cpu_end - record.pop('cpu_start')) / 1e9
+        record['start'] = (record['start'] - _state['origin']) / 1e3
+        if _state['memory']:
+            peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+            record['peak_bytes'] = peak - record.pop('memory_start')
+            for parent in _state['stack'][:-1]:
+                parent._peak = max(parent._peak, peak)
+        _state['stack'].pop()
+        with _lock:
+            _state['spans'].append(record)
+        return False
+
+    def count_bytes(self, *arrays):
+        self.record['bytes'] += sum(array.nbytes for array in arrays)
+
+
+def span(name, **attributes):
+    """
+    Measures the enclosed block as a named span.
+    :param name: Name of the span, spans with the same name are aggregated in the summary
+    :param attributes: Further json serializable details, e.g. the class of an SVD
+    :return: context manager
+    """
+    if not _state['enabled']:
+        return _NO_SPAN
+    return _Span(name, attributes)
+
+
+def count_bytes(*arrays):
+    """
+    Adds the bytes of the given arrays to the innermost open span.
+    :param arrays: numpy arrays allocated in the span
+    """
+    if _state['enabled'] and _state['stack']:
+        _state['stack'][-1].count_bytes(*arrays)
+
+
+def spans():
+    """
+    :return: list of the finished span records
+    """
+    return list(_state['spans'])
+
+
+def dump_trace(path):
+    """
+    Saves the finished spans in the Chrome trace event format.
+    :param path: Filepath of the json trace
+    """
+    events = [{'name': record['name'],
+               'ph': 'X',
+               'ts': record['start'],
+               'dur': record['wall_s'] * 1e6,
+               'pid': os.getpid(),
+               'tid': 0,
+               'args': dict(record['args'], cpu_s=record['cpu_s'], bytes=record['bytes'],
+                            peak_bytes=record.get('peak_bytes'))}
+              for record in sorted(_state['spans'], key=lambda record: record['start'])]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def summary():
+    """
+    Aggregates the finished spans by name in order of their first start.
+    :return: table as string with count, total wall and CPU time, maximal peak memory and total array bytes
+    """
+    rows = {}
+    for record in sorted(_state['spans'], key=lambda record: record['start']):
+        row = rows.setdefault(record['name'], {'depth': record['depth'], 'count': 0, 'wall_s': 0., 'cpu_s': 0.,
+                                               'peak_bytes': None, 'bytes': 0})
+        row['count'] += 1
+        row['wall_s'] += record['wall_s']
+        row['cpu_s'] += record['cpu_s']
+        row['bytes'] += record['bytes']
+        if 'peak_bytes' in record:
+            row['peak_bytes'] = max(row['peak_bytes'] or 0, record['peak_bytes'])
+    lines = [f"{'span':<32} {'count':>6} {'wall s':>10} {'cpu s':>10} {'peak MB':>10} {'array MB':>10}"]
+    for name, row in rows.items():
+        peak = f"{row['peak_bytes'] / (1024 * 1024):10.1f}" if row['peak_bytes'] is not None else f"{'-':>10}"
+        lines.append(f"{'  ' * row['depth'] + name:<32} {row['count']:>6} {row['wall_s']:>10.3f} "
+                     f"{row['cpu_s']:>10.3f} {peak} {row['bytes'] / (1024 * 1024):>10.1f}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    import numpy as np
+
+    enable()
+    with span('outer'):
+        with span('allocate', n=10 ** 6):
+            a = np.ones(10 ** 6)
+            count_bytes(a)
+        del a
+        with span('small'):
+            b = np.ones(10)
+    nested = {record['name']: record for record in spans()}
+    assert nested['allocate']['peak_bytes'] >= 8 * 10 ** 6
+    assert nested['outer']['peak_bytes'] >= nested['allocate']['peak_bytes']
+    assert nested['small']['peak_bytes'] < 8 * 10 ** 6
+    print(summary())
+
+    disable()
+    assert span('off') is span('other')
+    start = time.perf_counter()
+    for _ in range(10 ** 5):
+        with span('off'):
+            pass
+    print(f"Disabled span: {(time.perf_counter() - start) * 10:.3f} us")
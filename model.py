@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+@author: P.Schwarz, F.Rosenthal
+
+Summary: Versioned file format for trained models.
+
+A model file consists of
+    - the magic bytes b'SVDDIGIT', the format version and the header length as little endian uint32,
+    - a json header with the feature parameters and the layout of the data blocks,
+    - zero padding up to a multiple of 64 bytes,
+    - the truncated class bases as one contiguous (n_classes x n_features x k_max) C-ordered block,
+    - optionally the singular values as (n_classes x k_max) float64 block.
+Classes with less than k_max basis vectors are padded with zero columns, which do not change any residual.
+The header records the true rank of every class in 'ranks'.
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'SVDDIGIT'
+VERSION = 1
+ALIGNMENT = 64
+
+
+def save_model(path, svd_list, k_max=None, singular_values=None, **meta):
+    """
+    Writes class bases to a model file.
+    :param path: Filepath of the model
+    :param svd_list: List with the left singular vectors of every class
+    :param k_max: Number of basis vectors stored per class. Defaults to the largest basis in svd_list.
+    :param singular_values: Optional list with the singular values of every class. Their lengths give the ranks
+        of zero padded bases, as returned by training.calc_svd.
+    :param meta: Further json serializable header entries, e.g. cutoff_value, cutoff_index and max_shape
+    :return: header of the written model
+    """
+    if k_max is None:
+        k_max = max(u.shape[1] for u in svd_list)
+    ranks = [min(k_max, u.shape[1]) for u in svd_list]
+    if singular_values is not None:
+        ranks = [min(rank, len(s)) for rank, s in zip(ranks, singular_values)]
+    dtype = np.result_type(*svd_list)
+    header = dict(meta,
+                  n_classes=len(svd_list),
+                  n_features=svd_list[0].shape[0],
+                  k_max=k_max,
+                  ranks=ranks,
+                  dtype=dtype.name,
+                  singular_values=singular_values is not None)
+    header_bytes = json.dumps(header).encode()
+    prefix_length = len(MAGIC) + 8 + len(header_bytes)
+    padding = -prefix_length % ALIGNMENT
+    # the file is replaced at once, so processes that still map the old model keep valid pages
+    with open(path + '.tmp', 'wb') as f:
+        f.write(MAGIC + struct.pack('<II', VERSION, len(header_bytes) + padding))
+        f.write(header_bytes + b' ' * padding)
+        block = np.zeros((svd_list[0].shape[0], k_max), dtype=dtype)
+        for u, rank in zip(svd_list, ranks):
+            block[:, :rank] = u[:, :rank]
+            block[:, rank:] = 0
+            f.write(block.tobytes(order='C'))
+        if singular_values is not None:
+            values = np.zeros((len(svd_list), k_max))
+            for i, (s, rank) in enumerate(zip(singular_values, ranks)):
+                values[i, :rank] = s[:rank]
+            f.write(values.tobytes(order='C'))
+    os.replace(path + '.tmp', path)
+    return header
+
+
+def read_header(path):
+    """
+    Reads the header of a model file.
+    :param path: Filepath of the model
+    :return: header as dict, offset of the data blocks in bytes
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a model file.")
+        version, header_length = struct.unpack('<II', f.read(8))
+        if version > VERSION:
+            raise ValueError(f"Model format version {version} is not supported.")
+        header = json.loads(f.read(header_length).decode())
+    header['version'] = version
+    return header, len(MAGIC) + 8 + header_length
+
+
+def load_model(path, mmap=True):
+    """
+    Opens a model file. With mmap, the bases are memory mapped read only, so loading does not copy any data and
+    several processes share the same pages.
+    :param path: Filepath of the model
+    :param mmap: If false, the blocks are read into memory instead
+    :return: dict with the header entries, 'bases' (n_classes x n_features x k_max), 'singular_values'
+        (n_classes x k_max or None) and 'svd_list', a list of the class bases usable as svd_list
+    """
+    model, offset = read_header(path)
+    shape = (model['n_classes'], model['n_features'], model['k_max'])
+    dtype = np.dtype(model['dtype'])
+    if mmap:
+        bases = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+    else:
+        bases = np.fromfile(path, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+    singular_values = None
+    if model['singular_values']:
+        values_offset = offset + bases.nbytes
+        singular_values = np.fromfile(path, dtype=np.float64, count=shape[0] * shape[2],
+                                      offset=values_offset).reshape(shape[0], shape[2])
+    model['bases'] = bases
+    model['singular_values'] = singular_values
+    model['svd_list'] = [bases[i] for i in range(shape[0])]
+    return model
+
+
+if __name__ == '__main__':
+    import sys
+    header, _ = read_header(sys.argv[1])
+    for key, value in header.items():
+        print(key, ' : ', value)
@@ -6,24 +6,86 @@ Created on Wed Aug 10 16:17:53 2022
 """
 import os
 import time
-from os.path import isfile
-import joblib
-import pandas as pd
 
-from training import get_svd_path, calc_svd, filter_dataset, estimate_digit
-from spectrograms import create_all_spectrograms, stack_training, get_filepaths, train_test_split
-from util import format_time, plot_graph, plot_multiline_graph, plot_confusion_matrix, boxplot_residuals
+from cache import CacheManager, cache_key, fingerprint_files
+from instrumentation import span, enable, disable, dump_trace, summary
+from evaluation import RateLimitedLogger, evaluate, log_samples
+from model import save_model, load_model
+from reporting import ReportWorker, plot_overview, write_reports
+from training import calc_svd, filter_dataset, classify_batch, classify_batch_sweep, \
+    classify_cascade, compare_cascade, compare_svd_methods, compare_dtypes
+from spectrograms import create_all_spectrograms, stack_training, stack_test, get_filepaths, train_test_split, \
+    save_spectrogram_store, load_spectrogram_store, is_spectrogram_store, feature_params
+from util import format_time
 
 
-def digit_classifier(k_list=None, size=0, path="data/", verbose=False):
+def get_spectrogram_store(cache, filepaths, n_jobs=1, **spectrogram_args):
+    """
+    Returns the spectrogram store of a dataset from the cache and creates it on a cache miss.
+
+    :param cache: CacheManager
+    :param filepaths: Filepaths of the dataset
+    :param n_jobs: Number of worker processes used to calculate the spectrograms
+    :param spectrogram_args: Arguments of create_all_spectrograms, e.g. cutoff_value and dtype
+    :return: path of the store, cache key of the store
+    """
+    spec_key = cache_key(dataset=fingerprint_files(filepaths), **spectrogram_args)
+    with span('cache lookup'):
+        spec_storepath = cache.lookup('spectrograms', spec_key, validate=is_spectrogram_store)
+    if spec_storepath is None:
+        spec_dict = create_all_spectrograms(filepaths, n_jobs=n_jobs, **spectrogram_args)
+        print('Saving spectrogram-store...')
+        with span('store save'):
+            save_spectrogram_store(spec_dict, cache.staging_path('spectrograms', spec_key))
+            del spec_dict
+            spec_storepath = cache.commit('spectrograms', spec_key)
+    return spec_storepath, spec_key
+
+
+def digit_classifier(k_list=None, size=0, path="data/", chunk_size=512, svd_method='full', k_max=None,
+                     compare_svd=False, n_jobs=1, cutoff_value=6000, cache_size=None, invalidate_cache=False,
+                     sweep=True, dtype='float32', compare_dtype=False, time_layout='pad', n_frames=None,
+                     log_magnitude=False, n_bands=None, cascade=None, json_reports=False, trace=None,
+                     background_reports=True, plot=True, verbose=False):
     """
     Trains and tests the classification algorithm to determine digits spoken in the dataset audio files.
 
     :param k_list: Array of values, that determine how many singular values are used for the classification
     :param size: Amount of test samples to be used in the test run. Default is 50.
     :param path: Path to the file location of the testing data. Default is 'data/'.
-    :param verbose: If set to true, the single test results will be printed out during testing.
+    :param chunk_size: Number of test samples classified together in one batch of matrix products.
+    :param svd_method: SVD method used in training. One of 'full', 'economy', 'randomized', 'gram' and 'auto'.
+    :param k_max: Number of singular vectors stored per class. Defaults to max(k_list), also for the full SVD,
+        so the model file only holds the truncated bases and its k_max is the rank used by DigitPredictor.
+    :param compare_svd: If set to true, the error rates of the truncated SVD are compared to the full SVD after training.
+    :param n_jobs: Number of worker processes used to calculate the spectrograms.
+    :param cutoff_value: Frequencies above this value are cut off the spectrograms.
+    :param cache_size: Size limit of the cache directory in bytes. Least recently used artifacts are evicted beyond it.
+    :param invalidate_cache: If set to true, all cached artifacts are removed before the run.
+    :param sweep: If set to true, all values of k_list are evaluated in one pass at the cost of the largest k.
+    :param dtype: Data type of spectrograms, SVD and residuals. 'float32' for production, 'float64' for reference runs.
+    :param compare_dtype: If set to true, error rates and run times of float32 and float64 are compared after training.
+        Both use the spectrograms of dtype, so with 'float32' the float64 run gets upcast float32 features.
+    :param time_layout: 'pad' zero pads the spectrograms to the longest recording, 'resample' and 'pool' bring them
+        to n_frames time frames.
+    :param n_frames: Number of time frames of the 'resample' and 'pool' layouts.
+    :param log_magnitude: If set to true, the spectrogram magnitudes are compressed with log(1 + x).
+    :param n_bands: If given, the frequency bins are pooled into n_bands bands.
+    :param cascade: If given, a dict with the arguments of classify_cascade, e.g. {'screen_rank': 4, 'top_m': 3}.
+        The rank-k residuals are then only computed for the candidate classes of a cheap screening.
+        With the additional key 'compare': True, error rate and speedup against the full classification are printed.
+    :param json_reports: If set to true, the results of every k are additionally saved in the json format
+        of util.plot_confusion_matrix, e.g. reports/number_metrics_7500_1500.json.
+    :param trace: If given, every pipeline stage is measured and the spans are saved as json trace to this filepath.
+        A summary table of the stages is printed at the end of the run. Plots and reports are only measured as
+        'plotting' and 'reports' without background_reports, otherwise the run only sees their wait in 'report wait'.
+    :param background_reports: If set to true, plots and reports are rendered in a worker process while the next k
+        is evaluated. The run waits for the worker before it returns.
+    :param plot: If set to false, no plots are rendered, e.g. for headless throughput runs.
+    :param verbose: If set to true, the single test results will be printed out during testing, at most once per second.
     """
+    if trace is not None:
+        enable()
     if verbose:
         print("Verbose output is activated.")
     else:
@@ -31,25 +93,27 @@ def digit_classifier(k_list=None, size=0, path="data/", verbose=False):
 
     if k_list is None:
         k_list = [1500]
+    if k_max is None:
+        k_max = max(k_list)
 
     split_ratio = 0.25
     random_seed = 42
     filter_key = None
     filter_value = None
 
-    cachepath = os.path.join(os.getcwd(), "cache")
-    os.makedirs(cachepath, exist_ok=True)
+    cache = CacheManager(os.path.join(os.getcwd(), "cache"), max_bytes=cache_size)
+    if invalidate_cache:
+        cache.invalidate()
+    spec_storepath, spec_key = get_spectrogram_store(cache, get_filepaths(path), n_jobs=n_jobs,
+                                                     cutoff_value=cutoff_value, dtype=dtype,
+                                                     time_layout=time_layout, n_frames=n_frames,
+                                                     log_magnitude=log_magnitude, n_bands=n_bands)
+    svd_key = cache_key(spectrograms=spec_key, split_ratio=split_ratio, random_seed=random_seed,
+                        filter_key=filter_key, filter_value=filter_value, svd_method=svd_method, k_max=k_max)
 
-    spec_filepath = cachepath + "/spectrogram.z"
-    svd_filepath = cachepath + "/" + get_svd_path('digit', split_ratio, random_seed)
-
-    if isfile(spec_filepath):
-        print('Loading spectrogram data...')
-        content = joblib.load(spec_filepath)
-    else:
-        content = create_all_spectrograms(get_filepaths(path))
-        print('Saving spectrogram-file...')
-        joblib.dump(content, spec_filepath)
+    print('Loading spectrogram data...')
+    with span('cache load'):
+        content = load_spectrogram_store(spec_storepath)
 
     if filter_key is not None:
         indices = filter_dataset(content['specs'], filter_key)[filter_value]
@@ -57,91 +121,107 @@ def digit_classifier(k_list=None, size=0, path="data/", verbose=False):
         indices = [int(elem) for elem in content['specs'].keys()]
     train_set, test_set = train_test_split(indices, test_size=split_ratio, random_state=random_seed)
 
-    if isfile(svd_filepath):
+    if size < 1:
+        size = len(test_set)
+    test_matrix = stack_test(spec_dict=content, test_set=test_set[:size])
+    actual_digits = [content['specs'][sample]['digit'] for sample in test_set[:size]]
+
+    train_stack = None
+    model_filepath = cache.lookup('model_digit', svd_key)
+    if model_filepath is not None:
         print('Loading training data...')
-        svd_list = joblib.load(svd_filepath)
+        with span('cache load'):
+            svd_list = load_model(model_filepath)['svd_list']
     else:
         print('Generating training data...')
         train_stack = stack_training(spec_dict=content, train_set=train_set)
-        svd_list = calc_svd(train_stack=train_stack, subset_count=10)
-        joblib.dump(svd_list, svd_filepath)
+        with span('training'):
+            svd_list, sv_list = calc_svd(train_stack=train_stack, subset_count=10, method=svd_method, k_max=k_max,
+                                         random_seed=random_seed, dtype=dtype, return_singular_values=True)
+        with span('model save'):
+            save_model(cache.staging_path('model_digit', svd_key), svd_list, k_max=k_max, singular_values=sv_list,
+                       svd_method=svd_method, **feature_params(content))
+            cache.commit('model_digit', svd_key)
+
+    # the comparisons train their own models, so they also run if the model has been loaded from the cache
+    compare_svd = compare_svd and svd_method != 'full'
+    if (compare_svd or compare_dtype) and train_stack is None:
+        train_stack = stack_training(spec_dict=content, train_set=train_set)
+    if compare_svd:
+        print(f'Comparing {svd_method} SVD with full SVD...')
+        compare_svd_methods(train_stack, test_matrix, actual_digits, k_list, svd_method, k_max,
+                            random_seed=random_seed)
+    if compare_dtype:
+        print('Comparing float32 with float64...')
+        compare_dtypes(train_stack, test_matrix, actual_digits, k_list,
+                       'economy' if svd_method == 'full' else svd_method, k_max)
+    del train_stack
 
     print('Performing tests...')
+    if cascade is not None:
+        sweep = False
+        cascade = dict(cascade)
+        compare = cascade.pop('compare', False)
+    if sweep:
+        start = time.perf_counter_ns()
+        sweep_results = classify_batch_sweep(svd_list, k_list, test_matrix, chunk_size=chunk_size)
+        sweep_duration = time.perf_counter_ns() - start
+    logger = RateLimitedLogger()
+    worker = ReportWorker(background=background_reports, plot=plot)
+    evaluations = []
     all_error_rates = {}
     for k in k_list:
-        eval_dict = {'correct': 0,
-                     'incorrect': 0,
-                     'cases': {}}
-
-        if size < 1:
-            size = len(test_set)
         print(f"Testing {size} samples")
-        mean_duration = 0.0
-        error_rate_samples = []
-        step_times = []
-        start = time.time()
-
-        # iterate over test samples
-        for i in range(size):
-            print(f"### Sample {i + 1} of {size} under Test #", end="\t")
-            sample = test_set[i]
-            estimated_digit, k, res_list = estimate_digit(svd_list,
-                                                          k,
-                                                          content['specs'][sample]['spec'])
-            test_digit = content['specs'][sample]['digit']
-
-            print(f'Predicted class: {estimated_digit}.',
-                  f'Actual class: {test_digit}.', end=" ")
-
-            # write evaluation and update counter for correct or incorrect.
-            if estimated_digit == test_digit:
-                eval_dict['correct'] += 1
-                print("Success!")
-            else:
-                eval_dict['incorrect'] += 1
-                print("We'll get it next time!")
-
-            err_i = eval_dict['incorrect'] / (i + 1)
-            error_rate_samples.append(err_i)
-
-            delta = round((time.time() - start))
-            start = time.time()
-            step_times.append(delta)
-            mean_duration = (mean_duration * i + delta) / (i + 1)
-            remaining = (size - i) * mean_duration
-            print(f"Estimated time remaining: {format_time(remaining)}")
-
-            eval_dict['cases'][i] = {'estimated': estimated_digit,
-                                     'actual': test_digit,
-                                     'correct': estimated_digit == test_digit,
-                                     'error rate': err_i,
-                                     'duration': delta,
-                                     'residuals': res_list}
-
-        # print and plot the outcome
-        plot_graph(step_times, title="Time per Sample", ylabel="Seconds", ground=True)
-
-        all_error_rates[k] = error_rate_samples
-        error_rate = eval_dict['incorrect'] / size
-        success_rate = eval_dict['correct'] / size
-        print(f"Error rate: {error_rate * 100} %\nSuccess rate: {success_rate * 100} %")
-        plot_graph(error_rate_samples, title=f"Error Rate Convergence (k={k})", ylim=[0, 1])
+        if sweep:
+            estimated_digits, k, residuals = sweep_results[k]
+            duration = sweep_duration
+        elif cascade is not None:
+            start = time.perf_counter_ns()
+            estimated_digits, k, residuals, stats = classify_cascade(svd_list, k, test_matrix,
+                                                                     actual_digits=actual_digits,
+                                                                     chunk_size=chunk_size, **cascade)
+            duration = time.perf_counter_ns() - start
+            print(f"Cascade: true class pruned {stats['true_class_pruned'] * 100:.2f} %, "
+                  f"fallback {stats['fallback_rate'] * 100:.2f} %, "
+                  f"evaluated {stats['evaluated_fraction'] * 100:.2f} % of the rank-k residuals")
+            if compare:
+                print('Comparing cascade with full classification...')
+                compare_cascade(svd_list, k, test_matrix, actual_digits, chunk_size=chunk_size, **cascade)
+        else:
+            start = time.perf_counter_ns()
+            estimated_digits, k, residuals = classify_batch(svd_list, k, test_matrix, chunk_size=chunk_size)
+            duration = time.perf_counter_ns() - start
+        print(f"Classified {size} samples in {format_time(duration / 1e9)}")
+
+        evaluation = evaluate(k, test_set[:size], estimated_digits, actual_digits, residuals, duration)
+        evaluations.append(evaluation)
         if verbose:
-            for key, value in eval_dict.items():
-                if key != 'cases':
-                    print(key, ' : ', value)
+            log_samples(evaluation, logger)
 
-        # Save test results
-        metrics = {'samples': size, 'error_rate': error_rate, 'used_EV': k, 'results': eval_dict['cases']}
-        df = pd.DataFrame.from_dict(metrics)
-        os.makedirs(os.path.join(os.getcwd(), "reports"), exist_ok=True)
-        df.to_json(f'reports/number_metrics_{size}_{k}.json')
-        df.to_csv('reports/number_metrics.csv', mode="a", index=False, header=True)
-
-        plot_confusion_matrix(metrics)
-        boxplot_residuals(metrics)
-
-    plot_multiline_graph(all_error_rates, "Overview Error rates")
+        # print and plot the outcome
+        all_error_rates[k] = evaluation['error_rate']
+        error_rate = evaluation['error_rate'][-1]
+        print(f"Error rate: {error_rate * 100} %\nSuccess rate: {(1 - error_rate) * 100} %")
+
+        json_path = None
+        if json_reports:
+            os.makedirs(os.path.join(os.getcwd(), "reports"), exist_ok=True)
+            json_path = f'reports/number_metrics_{size}_{k}.json'
+        # in the background, the submit only pickles the job, rendering is waited for in 'report wait'
+        with span('report submit', k=k, background=background_reports):
+            worker.submit_evaluation(evaluation, json_path)
+
+    # Save test results of all k at once
+    with span('report submit', background=background_reports):
+        worker.submit(write_reports, evaluations, plot=False)
+        worker.submit(plot_overview, all_error_rates)
+    with span('report wait'):
+        worker.close()
+    print(cache.report())
+    if trace is not None:
+        disable()
+        dump_trace(trace)
+        print(summary())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+@author: P.Schwarz, F.Rosenthal
+
+Summary: Streaming classification of new recordings against a trained model.
+"""
+
+import os
+from itertools import islice, tee
+
+import numpy as np
+
+from model import load_model
+from spectrograms import compute_spectrogram, spectrogram_from_signal, normalize_spectrogram
+from training import classify_batch
+
+
+def iter_wav_files(path):
+    """
+    Walks a directory lazily and yields the filepaths of all wav files in sorted order.
+    :param path: Directory to search recursively
+    """
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith('.wav'):
+                yield os.path.join(root, filename)
+
+
+class DigitPredictor:
+    """
+    Classifies recordings with a model written by model.save_model.
+    The spectrograms are computed with the feature parameters of the model, i.e. its cutoff and window, and
+    brought to its max_shape time frames by its time layout, so recordings from outside the training dataset can be classified.
+    """
+
+    def __init__(self, model, k=None, batch_size=256, fs=48000):
+        """
+        :param model: Filepath of a model or a model as returned by model.load_model
+        :param k: Number of singular values used in the classification. Defaults to all stored basis vectors.
+        :param batch_size: Number of samples classified together. Bounds the memory of a stream.
+        :param fs: Sampling frequency assumed for raw arrays passed without one
+        """
+        self.model = load_model(model) if isinstance(model, (str, os.PathLike)) else model
+        self.k = self.model['k_max'] if k is None else min(k, self.model['k_max'])
+        if self.k >= self.model['n_features']:
+            print(f"Warning: k={self.k} spans the whole feature space, every residual is close to zero. "
+                  f"Pass a smaller k or retrain the model with k_max=max(k_list).")
+        self.batch_size = batch_size
+        self.fs = fs
+        self.dtype = np.dtype(self.model['dtype'])
+        self.window = {'nperseg': self.model.get('nperseg', 256), 'noverlap': self.model.get('noverlap')}
+
+    def features(self, item):
+        """
+        Computes the flattened feature vector of one recording.
+        :param item: Filepath of a wav file, (fs, signal) tuple or signal array sampled with self.fs
+        :return: feature vector of length n_features
+        """
+        if isinstance(item, (str, os.PathLike)):
+            _, _, Sxx = compute_spectrogram(item, self.model['cutoff_index'], self.dtype, **self.window)
+        else:
+            fs, x = item if isinstance(item, tuple) else (self.fs, item)
+            _, _, Sxx = spectrogram_from_signal(np.asarray(x), fs, self.model['cutoff_index'], self.dtype,
+                                               **self.window)
+        return normalize_spectrogram(Sxx, self.model['max_shape'], self.model.get('time_layout', 'pad'),
+                                     self.model.get('log_magnitude', False), self.model.get('n_bands'))
+
+    def predict(self, items):
+        """
+        Classifies recordings lazily. The recordings are read and classified batch by batch,
+        so streams of arbitrary length are processed with bounded memory.
+        :param items: A single recording or an iterable of recordings as accepted by features()
+        :return: generator of (digit, residuals) per recording
+        """
+        if isinstance(items, (str, os.PathLike, tuple, np.ndarray)):
+            items = [items]
+        items = iter(items)
+        batch = np.empty((self.model['n_features'], self.batch_size), dtype=self.dtype, order='F')
+        while True:
+            n = 0
+            for item in islice(items, self.batch_size):
+                batch[:, n] = self.features(item)
+                n += 1
+            if n == 0:
+                return
+            digits, _, residuals = classify_batch(self.model['svd_list'], self.k, batch[:, :n],
+                                                  chunk_size=self.batch_size)
+            for digit, residual in zip(digits, residuals):
+                yield int(digit), residual
+            if n < self.batch_size:
+                return
+
+    def predict_directory(self, path):
+        """
+        Classifies all wav files below a directory lazily.
+        :param path: Directory to search recursively
+        :return: generator of (filepath, digit, residuals)
+        """
+        # tee only buffers the paths of the batch in progress
+        filepaths, stream = tee(iter_wav_files(path))
+        for filepath, (digit, residuals) in zip(filepaths, self.predict(stream)):
+            yield filepath, digit, residuals
+
+
+if __name__ == '__main__':
+    import sys
+    predictor = DigitPredictor(sys.argv[1])
+    for filepath, digit, _ in predictor.predict_directory(sys.argv[2]):
+        print(f"{filepath}\t{digit}")
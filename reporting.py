@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+@author: P.Schwarz, F.Rosenthal
+
+Summary: Rendering of plots and reports off the critical path.
+
+A ReportWorker hands the rendering jobs to a worker process, so the evaluation of the next k does not wait for
+matplotlib. flush() waits for all submitted jobs and raises their errors, close() also stops the worker.
+Workers that are still open when the interpreter exits are closed, so no report is lost.
+The jobs are measured as 'plotting' and 'reports' spans, which only reach the trace if they run in the traced
+process, i.e. without background.
+
+    with ReportWorker(plot=True) as worker:
+        for evaluation in evaluations:
+            worker.submit_evaluation(evaluation)
+        worker.submit(plot_overview, all_error_rates)
+"""
+
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+
+from evaluation import save_reports, save_json_report
+from instrumentation import span, disable
+
+
+def plot_evaluation(evaluation):
+    """
+    Renders the plots of one k: error rate convergence, confusion matrix and residual boxplots.
+    There is no plot of the time per sample, the samples are classified in batches and only the batch mean is known.
+    :param evaluation: evaluation dict
+    """
+    with span('plotting', k=evaluation['k']):
+        from util import plot_graph, plot_confusion_matrix, boxplot_residuals
+        plot_graph(evaluation['error_rate'], title=f"Error Rate Convergence (k={evaluation['k']})", ylim=[0, 1])
+        plot_confusion_matrix(evaluation)
+        boxplot_residuals(evaluation)
+
+
+def plot_overview(all_error_rates):
+    """
+    Renders the error rate convergence of all k in one plot.
+    :param all_error_rates: dict with k as keys and the error rates over the test samples as values
+    """
+    with span('plotting'):
+        from util import plot_multiline_graph
+        plot_multiline_graph(all_error_rates, "Overview Error rates")
+
+
+def write_reports(evaluations):
+    """
+    Saves the reports of all k, see evaluation.save_reports.
+    :param evaluations: List of evaluation dicts
+    """
+    with span('reports'):
+        print(f"Saved test results to {save_reports(evaluations)}")
+
+
+class ReportWorker:
+    """
+    Runs report and plot jobs in a background process or, if background is false, right away.
+    """
+
+    def __init__(self, background=True, plot=True):
+        """
+        :param background: If true, jobs run in one worker process. Otherwise they run when they are submitted.
+        :param plot: If false, plot jobs are skipped, e.g. for headless throughput runs. Reports are still written.
+        """
+        self.plot = plot
+        # a forked worker inherits the tracing of the parent, which would slow down every allocation of matplotlib
+        self._pool = ProcessPoolExecutor(max_workers=1, initializer=disable) if background else None
+        self._futures = []
+        atexit.register(self.close)
+
+    def submit(self, function, *args, plot=True, **kwargs):
+        """
+        Submits a job. Its arguments are pickled, so later changes by the caller do not affect the job.
+        :param function: Module level function rendering a plot or writing a report
+        :param args: Arguments of the function
+        :param plot: True if the job is a plot, which is skipped unless the worker plots
+        :param kwargs: Keyword arguments of the function
+        """
+        if plot and not self.plot:
+            return
+        if self._pool is None:
+            function(*args, **kwargs)
+        else:
+            self._futures.append(self._pool.submit(function, *args, **kwargs))
+
+    def submit_evaluation(self, evaluation, json_path=None):
+        """
+        Submits the plots of one k and, if json_path is given, its json report.
+        :param evaluation: evaluation dict
+        :param json_path: Optional filepath of the json report, see evaluation.save_json_report
+        """
+        if json_path is not None:
+            self.submit(save_json_report, evaluation, json_path, plot=False)
+        self.submit(plot_evaluation, evaluation)
+
+    def flush(self):
+        """
+        Waits until all submitted jobs are done and raises the first error of a job.
+        """
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        """
+        Waits for all submitted jobs and stops the worker process.
+        """
+        atexit.unregister(self.close)
+        if self._pool is not None:
+            try:
+                self.flush()
+            finally:
+                self._pool.shutdown()
+                self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+@author: F.Rosenthal, P.Schwarz
+
+Summary: Digit spotting in continuous recordings.
+"""
+
+import numpy as np
+from scipy.io import wavfile
+
+from predictor import DigitPredictor
+from spectrograms import spectrogram_from_signal
+
+
+class DigitSpotter:
+    """Detects utterances in a stream of audio chunks and classifies each one as soon as it is complete.
+
+    The energy of every spectrogram frame is compared to an adaptive noise floor. A segment starts with the first
+    frame above threshold_ratio times the noise floor and ends after min_silence seconds below it or once it reaches
+    the longest training recording (max_frames) of the model. Only the last samples needed for one segment are kept, so the memory
+    does not depend on the length of the recording.
+    """
+
+    def __init__(self, model, fs, k=None, threshold_ratio=10.0, min_speech=0.1, min_silence=0.15, pre_roll=0.05):
+        """
+        Args:
+            model (string or dict): Filepath of a model or a model as returned by model.load_model.
+            fs (int): Sampling frequency of the stream.
+            k (int, optional): Number of singular values used in the classification. Defaults to all.
+            threshold_ratio (float, optional): Factor of the noise floor above which a frame counts as speech. Defaults to 10.
+            min_speech (float, optional): Segments with less speech in seconds are discarded. Defaults to 0.1.
+            min_silence (float, optional): Silence in seconds that ends a segment. Defaults to 0.15.
+            pre_roll (float, optional): Seconds before the first speech frame added to a segment. Defaults to 0.05.
+        """
+        self.predictor = DigitPredictor(model, k=k, batch_size=1, fs=fs)
+        self.fs = fs
+        self.nperseg = self.predictor.window['nperseg']
+        noverlap = self.predictor.window['noverlap']
+        self.hop = self.nperseg - (self.nperseg // 8 if noverlap is None else noverlap)
+        # chunks are processed in blocks of at most this many samples
+        self.block = 16 * self.hop
+        self.threshold_ratio = threshold_ratio
+        self.min_speech_frames = max(1, int(min_speech * fs / self.hop))
+        self.min_silence_frames = max(1, int(min_silence * fs / self.hop))
+        self.max_frames = self.predictor.model.get('max_frames', self.predictor.model['max_shape'])
+        self.pre_roll = int(pre_roll * fs)
+        # longest segment plus the samples of one block processed after its end
+        history_length = self.pre_roll + (self.max_frames + 1) * self.hop + 2 * self.nperseg + self.block
+        self.history = np.zeros(history_length)
+        self.history_end = 0      # absolute index of the sample following the history
+        self.leftover = np.zeros(0)
+        self.position = 0         # absolute index of the first leftover sample
+        self.noise_floor = None
+        self.segment_start = None
+        self.segment_frames = 0
+        self.silence_run = 0
+
+    def process(self, chunk):
+        """Consumes the next chunk of the stream.
+
+        Args:
+            chunk (nd.array): Next samples of the stream. Multi channel chunks are reduced to the first channel.
+
+        Returns:
+            list: (start in seconds, end in seconds, digit, residuals) of every segment completed in this chunk.
+        """
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if chunk.ndim > 1:
+            chunk = chunk[:, 0]
+        detections = []
+        for i in range(0, len(chunk), self.block):
+            detections.extend(self._process_block(chunk[i:i + self.block]))
+        return detections
+
+    def _process_block(self, chunk):
+        self._remember(chunk)
+        buffer = np.concatenate((self.leftover, chunk))
+        if len(buffer) < self.nperseg:
+            self.leftover = buffer
+            return []
+        _, _, Sxx = spectrogram_from_signal(buffer, self.fs, self.predictor.model['cutoff_index'], np.float64,
+                                           **self.predictor.window)
+        energies = Sxx.sum(axis=0)
+        detections = []
+        for j, energy in enumerate(energies):
+            frame_start = self.position + j * self.hop
+            detection = self._step(energy, frame_start)
+            if detection is not None:
+                detections.append(detection)
+        consumed = len(energies) * self.hop
+        self.leftover = buffer[consumed:]
+        self.position += consumed
+        return detections
+
+    def flush(self):
+        """Ends the stream and classifies a segment that is still open.
+
+        Returns:
+            list: The last detection, if any.
+        """
+        if self.segment_start is None:
+            return []
+        detection = self._close(self.position + len(self.leftover))
+        return [] if detection is None else [detection]
+
+    def spot(self, chunks):
+        """Consumes a stream of chunks lazily.
+
+        Args:
+            chunks (iterable): Chunks of samples.
+
+        Yields:
+            tuple: (start in seconds, end in seconds, digit, residuals) of every detected segment.
+        """
+        for chunk in chunks:
+            yield from self.process(chunk)
+        yield from self.flush()
+
+    def _remember(self, chunk):
+        self.history = np.roll(self.history, -len(chunk))
+        self.history[len(self.history) - len(chunk):] = chunk
+        self.history_end += len(chunk)
+
+    def _step(self, energy, frame_start):
+        if self.noise_floor is None:
+            self.noise_floor = energy
+        threshold = self.threshold_ratio * max(self.noise_floor, np.finfo(np.float64).tiny)
+        if self.segment_start is None:
+            if energy > threshold:
+                self.segment_start = max(0, frame_start - self.pre_roll)
+                self.segment_frames = 1
+                self.silence_run = 0
+            else:
+                # follow decreasing noise immediately and increasing noise slowly
+                self.noise_floor = min(energy, 0.95 * self.noise_floor + 0.05 * energy)
+            return None
+        self.segment_frames += 1
+        self.silence_run = 0 if energy > threshold else self.silence_run + 1
+        if self.silence_run >= self.min_silence_frames or self.segment_frames >= self.max_frames:
+            return self._close(frame_start + self.nperseg)
+        return None
+
+    def _close(self, segment_end):
+        speech_frames = self.segment_frames - self.silence_run
+        history_start = self.history_end - len(self.history)
+        start = max(self.segment_start, history_start)
+        samples = self.history[start - history_start:segment_end - history_start]
+        self.segment_start = None
+        self.segment_frames = 0
+        self.silence_run = 0
+        if speech_frames < self.min_speech_frames:
+            return None
+        digit, residuals = next(self.predictor.predict((self.fs, samples)))
+        return start / self.fs, segment_end / self.fs, digit, residuals
+
+
+def iter_wav_chunks(wav_fname, chunk_duration=0.5):
+    """Reads a wav file in chunks without loading it into memory.
+
+    Args:
+        wav_fname (string): Filepath to the wav file.
+        chunk_duration (float, optional): Length of the chunks in seconds. Defaults to 0.5.
+
+    Returns:
+        tuple: Sampling frequency and a generator of the chunks.
+    """
+    fs, x = wavfile.read(wav_fname, mmap=True)
+    chunk_size = max(1, int(chunk_duration * fs))
+    return fs, (np.array(x[i:i + chunk_size]) for i in range(0, len(x), chunk_size))
+
+
+def spot_digits(model, wav_fname, chunk_duration=0.5, **kwargs):
+    """Detects and classifies all spoken digits in a long recording.
+
+    Args:
+        model (string or dict): Filepath of a model or a model as returned by model.load_model.
+        wav_fname (string): Filepath to the wav file.
+        chunk_duration (float, optional): Length of the processed chunks in seconds. Defaults to 0.5.
+        kwargs: Further arguments of DigitSpotter.
+
+    Yields:
+        tuple: (start in seconds, end in seconds, digit, residuals) of every detected segment.
+    """
+    fs, chunks = iter_wav_chunks(wav_fname, chunk_duration)
+    yield from DigitSpotter(model, fs, **kwargs).spot(chunks)
+
+
+if __name__ == '__main__':
+    import sys
+    for start, end, digit, _ in spot_digits(sys.argv[1], sys.argv[2]):
+        print(f"{start:8.2f} s - {end:8.2f} s\t{digit}")
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+@author: P.Schwarz, F.Rosenthal
+
+Summary: Local HTTP classification service with micro-batching.
+
+The model is loaded once. Every POST /classify request carries one wav file as body. Requests arriving within
+the latency window are coalesced into one batch and classified together. GET /metrics returns latency
+percentiles and batch sizes as json. Latencies are measured from the receipt of the request, so they include
+the parsing of the wav file and the feature extraction. These and the classification of a batch run in a thread
+pool off the event loop, so the server keeps accepting requests meanwhile.
+"""
+
+import asyncio
+import io
+import json
+import time
+from collections import deque
+from functools import partial
+
+import numpy as np
+from scipy.io import wavfile
+
+from predictor import DigitPredictor
+from training import classify_batch
+
+
+class ClassificationService:
+    """
+    Collects classification requests in a queue and classifies them in micro-batches.
+    """
+
+    def __init__(self, model, k=None, max_batch_size=64, max_latency=0.005, metrics_window=10000):
+        """
+        :param model: Filepath of a model or a model as returned by model.load_model
+        :param k: Number of singular values used in the classification
+        :param max_batch_size: Maximal number of requests per batch
+        :param max_latency: Time in seconds the first request of a batch waits for further requests
+        :param metrics_window: Number of latest requests and batches the latency and batch size metrics are
+            computed over, so the memory of a long running service stays bounded
+        """
+        self.predictor = DigitPredictor(model, k=k, batch_size=max_batch_size)
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.latencies = deque(maxlen=metrics_window)
+        self.batch_sizes = deque(maxlen=metrics_window)
+        self.requests = 0
+        self.batches = 0
+        self._queue = None
+        self._worker = None
+
+    async def start(self):
+        """Starts the batching worker in the running event loop."""
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Cancels the batching worker."""
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+
+    def _features(self, wav_bytes):
+        fs, x = wavfile.read(io.BytesIO(wav_bytes))
+        return self.predictor.features((fs, x))
+
+    async def classify(self, wav_bytes, received=None):
+        """
+        Classifies one wav file.
+        :param wav_bytes: Content of a wav file
+        :param received: perf_counter time the request has been received. Defaults to now.
+        :return: most likely digit, list of all residuals
+        """
+        if received is None:
+            received = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        # parsing and feature extraction would block the event loop and with it all other requests
+        features = await loop.run_in_executor(None, self._features, wav_bytes)
+        future = loop.create_future()
+        await self._queue.put((received, features, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            matrix = np.column_stack([features for _, features, _ in batch])
+            try:
+                # the residuals of a large batch take long enough to stall the event loop, they run in a thread
+                digits, _, residuals = await loop.run_in_executor(
+                    None, partial(classify_batch, self.predictor.model['svd_list'], self.predictor.k, matrix,
+                                  chunk_size=self.max_batch_size))
+            except Exception as error:
+                for _, _, future in batch:
+                    future.set_exception(error)
+                continue
+            now = time.perf_counter()
+            self.batches += 1
+            self.requests += len(batch)
+            self.batch_sizes.append(len(batch))
+            for (received, _, future), digit, residual in zip(batch, digits, residuals):
+                self.latencies.append(now - received)
+                future.set_result((int(digit), residual.tolist()))
+
+    def metrics(self):
+        """
+        :return: dict with request and batch count, p50 and p99 latency in milliseconds and batch size statistics.
+            Latencies and batch sizes cover the last metrics_window requests and batches.
+        """
+        if not self.latencies:
+            return {'requests': 0, 'batches': 0}
+        latencies = np.array(self.latencies) * 1000
+        return {'requests': self.requests,
+                'batches': self.batches,
+                'latency_p50_ms': float(np.percentile(latencies, 50)),
+                'latency_p99_ms': float(np.percentile(latencies, 99)),
+                'batch_size_mean': float(np.mean(self.batch_sizes)),
+                'batch_size_max': int(np.max(self.batch_sizes))}
+
+
+async def _respond(writer, status, payload):
+    body = json.dumps(payload).encode()
+    writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                 f"Connection: close\r\n\r\n".encode() + body)
+    await writer.drain()
+    writer.close()
+
+
+async def _handle(service, reader, writer):
+    try:
+        request_line = (await reader.readline()).decode().split()
+        received = time.perf_counter()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode().strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        method, target = request_line[0], request_line[1]
+        if method == 'GET' and target == '/metrics':
+            await _respond(writer, "200 OK", service.metrics())
+        elif method == 'POST' and target == '/classify':
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            digit, residuals = await service.classify(body, received)
+            await _respond(writer, "200 OK", {'digit': digit, 'residuals': residuals})
+        else:
+            await _respond(writer, "404 Not Found", {'error': f"{method} {target} not found"})
+    except Exception as error:
+        await _respond(writer, "400 Bad Request", {'error': str(error)})
+
+
+async def start_server(service, host='127.0.0.1', port=8000):
+    """
+    Starts the service and an HTTP server for it.
+    :param service: ClassificationService
+    :param host: Host to bind
+    :param port: Port to bind. 0 chooses a free port.
+    :return: asyncio server
+    """
+    await service.start()
+    return await asyncio.start_server(lambda reader, writer: _handle(service, reader, writer), host, port)
+
+
+async def request(host, port, method, target, body=b""):
+    """
+    Minimal HTTP client for the service, e.g. to test it in the same process.
+    :param host: Host of the server
+    :param port: Port of the server
+    :param method: 'GET' or 'POST'
+    :param target: '/classify' or '/metrics'
+    :param body: Content of a wav file for '/classify'
+    :return: decoded json response
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"{method} {target} HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return json.loads(response.partition(b"\r\n\r\n")[2])
+
+
+def serve(model, host='127.0.0.1', port=8000, k=None, max_batch_size=64, max_latency=0.005):
+    """
+    Runs the classification service until it is interrupted.
+    :param model: Filepath of a model
+    :param host: Host to bind
+    :param port: Port to bind
+    :param k: Number of singular values used in the classification
+    :param max_batch_size: Maximal number of requests per batch
+    :param max_latency: Time in seconds the first request of a batch waits for further requests
+    """
+    async def main():
+        service = ClassificationService(model, k=k, max_batch_size=max_batch_size, max_latency=max_latency)
+        server = await start_server(service, host, port)
+        print(f"Serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+if __name__ == '__main__':
+    import sys
+    serve(sys.argv[1], port=int(sys.argv[2]) if len(sys.argv) > 2 else 8000)
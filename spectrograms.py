@@ -3,13 +3,35 @@
 @author: F.Rosenthal
 """
 
+import json
+import time
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
 from os import listdir
+from os import makedirs
 from os import walk
+from os.path import isfile
+from os.path import join as path_join
 from scipy.io import wavfile
-from scipy.signal import spectrogram
-from util import plot_spectrogram
+from instrumentation import span, count_bytes
 import numpy as np
-from sklearn.model_selection import train_test_split
+
+
+def train_test_split(*arrays, **options):
+    """Wrapper of sklearn.model_selection.train_test_split, which imports sklearn only when a split is made.
+    Classifying with a trained model does not need sklearn.
+
+    Args:
+        arrays: Sequences to split, e.g. the indices of a spectrogram dict.
+        options: Keyword arguments of sklearn's train_test_split, e.g. test_size and random_state.
+
+    Returns:
+        list: train and test split of every sequence in arrays.
+    """
+    from sklearn.model_selection import train_test_split as split
+    return split(*arrays, **options)
 
 
 def get_filepaths(path="data/"):
@@ -30,7 +52,165 @@ def get_filepaths(path="data/"):
     return filepaths
 
 
-def create_all_spectrograms(filepaths, cutoff_value=6000, plot=False, verbose=False):
+def cutoff_to_index(cutoff_value, nperseg=256, fs=48000):
+    """Converts a cutoff frequency to the number of frequency bins kept in a spectrogram.
+
+    Args:
+        cutoff_value (int): Cutoff frequency in Hz.
+        nperseg (int, optional): Window length of the spectrogram. Defaults to 256.
+        fs (int, optional): Sampling frequency. Defaults to the 48 kHz of AudioMNIST.
+
+    Returns:
+        int: The cutoff index.
+    """
+    return int(cutoff_value / (fs / nperseg))
+
+
+def parse_filename(wav_fname):
+    """Reads the spoken digit and the speaker from a filepath following the AudioMNIST naming
+    digit_speaker_index.wav.
+
+    Args:
+        wav_fname (string): Filepath to the wav file.
+
+    Returns:
+        tuple: digit (int), speaker (int)
+    """
+    short_name = wav_fname.split(sep='/')[-1]
+    return int(short_name.split(sep="_")[0]), int(short_name.split(sep="_")[1])
+
+
+def spectrogram_from_signal(x, fs, cutoff_index, dtype=np.float32, nperseg=256, noverlap=None):
+    """Calculates the spectrogram of a signal up to the cutoff index.
+
+    Args:
+        x (nd.array): Audio signal.
+        fs (int): Sampling frequency of the signal.
+        cutoff_index (int): Number of frequency bins to keep.
+        dtype (numpy dtype, optional): Data type the spectrogram is computed and returned in. Defaults to np.float32.
+        nperseg (int, optional): Window length of scipy.signal.spectrogram. Defaults to 256.
+        noverlap (int, optional): Overlap of the windows. Defaults to nperseg // 8.
+
+    Returns:
+        tuple: Frequency vector, time vector and spectrogram as returned by scipy.signal.spectrogram.
+    """
+    # scipy.signal takes about a second to import and is not needed to classify cached spectrograms
+    from scipy.signal import spectrogram
+    # the signal is cast first, scipy computes integer signals in float32 and a later cast would only upcast
+    f, t, Sxx = spectrogram(np.asarray(x, dtype=dtype), fs, nperseg=nperseg, noverlap=noverlap)
+    return f[0:cutoff_index], t, Sxx[0:cutoff_index, :].astype(dtype, copy=False)
+
+
+def compute_spectrogram(wav_fname, cutoff_index, dtype=np.float32, nperseg=256, noverlap=None):
+    """Reads one wav file and calculates its spectrogram up to the cutoff index.
+
+    Args:
+        wav_fname (string): Filepath to the wav file.
+        cutoff_index (int): Number of frequency bins to keep.
+        dtype (numpy dtype, optional): Data type of the returned spectrogram. Defaults to np.float32.
+        nperseg (int, optional): Window length of scipy.signal.spectrogram. Defaults to 256.
+        noverlap (int, optional): Overlap of the windows. Defaults to nperseg // 8.
+
+    Returns:
+        tuple: Frequency vector, time vector and spectrogram as returned by scipy.signal.spectrogram.
+    """
+    fs, x = wavfile.read(wav_fname)
+    return spectrogram_from_signal(x, fs, cutoff_index, dtype, nperseg, noverlap)
+
+
+def pad_spectrogram(Sxx, max_shape):
+    """Zero pads or truncates a spectrogram to max_shape time frames and flattens it.
+
+    Args:
+        Sxx (nd.array): Spectrogram with frequency bins as rows.
+        max_shape (int): Number of time frames of the result.
+
+    Returns:
+        nd.array: The flattened spectrogram.
+    """
+    Sxx = Sxx[:, :max_shape]
+    npad = ((0, 0), (0, max_shape - Sxx.shape[1]))
+    return np.pad(Sxx, pad_width=npad, mode='constant', constant_values=(0)).flatten('C')
+
+
+def resize_frames(Sxx, n_frames, method='resample'):
+    """Brings a spectrogram to a fixed number of time frames.
+
+    Args:
+        Sxx (nd.array): Spectrogram with frequency bins as rows.
+        n_frames (int): Number of time frames of the result.
+        method (string, optional): 'resample' interpolates the frames linearly, 'pool' averages
+            consecutive frames. Spectrograms shorter than n_frames are always resampled. Defaults to 'resample'.
+
+    Returns:
+        nd.array: Spectrogram with n_frames columns.
+    """
+    length = Sxx.shape[1]
+    if method == 'pool' and length >= n_frames:
+        bounds = np.linspace(0, length, n_frames + 1).astype(int)
+        return (np.add.reduceat(Sxx, bounds[:-1], axis=1) / np.diff(bounds)).astype(Sxx.dtype)
+    if length == 1:
+        return np.repeat(Sxx, n_frames, axis=1)
+    positions = np.linspace(0, length - 1, n_frames)
+    left = np.minimum(positions.astype(int), length - 2)
+    weight = (positions - left).astype(Sxx.dtype)
+    return Sxx[:, left] * (1 - weight) + Sxx[:, left + 1] * weight
+
+
+def pool_bands(Sxx, n_bands):
+    """Averages adjacent frequency bins into n_bands bands of (nearly) equal width.
+
+    Args:
+        Sxx (nd.array): Spectrogram with frequency bins as rows.
+        n_bands (int): Number of frequency bands of the result.
+
+    Returns:
+        nd.array: Spectrogram with n_bands rows.
+    """
+    bounds = np.linspace(0, Sxx.shape[0], n_bands + 1).astype(int)
+    return (np.add.reduceat(Sxx, bounds[:-1], axis=0) / np.diff(bounds)[:, np.newaxis]).astype(Sxx.dtype)
+
+
+def normalize_spectrogram(Sxx, max_shape, time_layout='pad', log_magnitude=False, n_bands=None):
+    """Turns a spectrogram into a flattened feature vector of fixed length.
+
+    Args:
+        Sxx (nd.array): Spectrogram with frequency bins as rows.
+        max_shape (int): Number of time frames of the result.
+        time_layout (string, optional): 'pad' zero pads or truncates the spectrogram, 'resample' and 'pool'
+            resize it with resize_frames. Defaults to 'pad'.
+        log_magnitude (bool, optional): If True, the magnitudes are compressed with log(1 + x). Defaults to False.
+        n_bands (int, optional): If given, the frequency bins are pooled into n_bands bands. Defaults to None.
+
+    Returns:
+        nd.array: The flattened feature vector.
+    """
+    if n_bands is not None:
+        Sxx = pool_bands(Sxx, n_bands)
+    if log_magnitude:
+        Sxx = np.log1p(Sxx)
+    if time_layout == 'pad':
+        return pad_spectrogram(Sxx, max_shape)
+    return resize_frames(Sxx, max_shape, time_layout).flatten('C')
+
+
+def feature_params(spec_dict):
+    """Collects the parameters needed to compute features like the ones in spec_dict, e.g. for a model header.
+
+    Args:
+        spec_dict (dict): The dictionary returned by create_all_spectrograms or load_spectrogram_store.
+
+    Returns:
+        dict: The feature parameters. Missing entries of older spectrogram stores are set to their defaults.
+    """
+    defaults = {'cutoff_value': 6000, 'cutoff_index': 32, 'max_shape': None, 'max_frames': spec_dict['max_shape'],
+                'time_layout': 'pad', 'log_magnitude': False, 'n_bands': None, 'nperseg': 256, 'noverlap': 32}
+    return {key: spec_dict.get(key, default) for key, default in defaults.items()}
+
+
+def create_all_spectrograms(filepaths, cutoff_value=6000, plot=False, n_jobs=1, dtype=np.float32, nperseg=256,
+                            noverlap=None, time_layout='pad', n_frames=None, log_magnitude=False, n_bands=None,
+                            verbose=False):
     """This function calculates all spectrograms to the files specified with their filepaths.
     They are saved in a nested dictionary and assigned to a index.
 
@@ -45,14 +225,33 @@ def create_all_spectrograms(filepaths, cutoff_value=6000, plot=False, verbose=Fa
         filepaths (list of strings): Filepaths to files.
         cutoff_value (int, optional): Controls the spectrogram size. Frequencies above this value will be cutoff. Defaults to 6000.
         plot (bool, optional): If True, the function will plot a spectrogram every 500 files. Defaults to False.
+        n_jobs (int, optional): Number of worker processes the files are distributed to. The ids are assigned
+            in the order of filepaths regardless of n_jobs. Defaults to 1.
+        dtype (numpy dtype, optional): Data type of the spectrograms. Use np.float64 for reference runs.
+            Defaults to np.float32.
+        nperseg (int, optional): Window length of scipy.signal.spectrogram. Defaults to 256.
+        noverlap (int, optional): Overlap of the windows. Defaults to nperseg // 8.
+        time_layout (string, optional): 'pad' zero pads all spectrograms to the longest one. 'resample' and 'pool'
+            bring every spectrogram to n_frames time frames instead, see resize_frames. Defaults to 'pad'.
+        n_frames (int, optional): Number of time frames of the 'resample' and 'pool' layouts. Defaults to 32.
+        log_magnitude (bool, optional): If True, the magnitudes are compressed with log(1 + x). Defaults to False.
+        n_bands (int, optional): If given, the frequency bins are pooled into n_bands bands. Defaults to None.
+        verbose (bool, optional): If True, the progress will be printed every 500 files. Defaults to False.
 
     Returns:
         dict: A nested dictionary containing meta data of the dataset, as well as all zero padded spectrograms and meta data for each file:
             The returned dictionary is structured as follow:
 
-            spec_dict = {'max_shape': int,    # maximum time length of a sample in dataset used in zero padding
+            spec_dict = {'max_shape': int,    # number of time frames of every feature vector
+                        'max_frames': int,    # maximum time length of a sample in dataset
+                        'time_layout': string,  # 'pad', 'resample' or 'pool'
+                        'log_magnitude': bool,
+                        'n_bands': int,       # number of pooled frequency bands or None
                         'cutoff_value': int,  # used cutoff frequency
                         'cutoff_index': int,  # corresponding cutoff index
+                        'dtype': string,      # name of the data type of the spectrograms
+                        'nperseg': int,       # window length
+                        'noverlap': int,      # overlap of the windows
                         'specs': {}}          # the nested dict with spectrograms
 
                         # and in the nested dict, where id is an int and the index corresponding to the specific file:
@@ -67,58 +266,88 @@ def create_all_spectrograms(filepaths, cutoff_value=6000, plot=False, verbose=Fa
         if verbose and i % 500 == 0:
             print(f"{i}/{len_filepaths}", end=" ")
 
-    cutoff_index = int(cutoff_value / 187.5)
+    if noverlap is None:
+        noverlap = nperseg // 8
+    cutoff_index = cutoff_to_index(cutoff_value, nperseg)
+    if time_layout not in ('pad', 'resample', 'pool'):
+        raise ValueError(f"Unknown time layout '{time_layout}'.")
     spec_dict = {'max_shape': 0,
+                 'max_frames': 0,
+                 'time_layout': time_layout,
+                 'log_magnitude': log_magnitude,
+                 'n_bands': n_bands,
                  'cutoff_value': cutoff_value,
                  'cutoff_index': cutoff_index,
+                 'dtype': np.dtype(dtype).name,
+                 'nperseg': nperseg,
+                 'noverlap': noverlap,
                  'specs': {}}
     print("Calculating spectrograms...")
     id = 0
     len_filepaths = len(filepaths)
-    for i, wav_fname in enumerate(filepaths):
-        print_progress(i=i, len_filepaths=len_filepaths)
-        fs, x = wavfile.read(wav_fname)
-        f, t, Sxx = spectrogram(x, fs)
-        Sxx = Sxx[0:cutoff_index, :]
-        f = f[0:cutoff_index]
-
-        if plot and i % 500 == 0:
-            plot_spectrogram(t, f, Sxx)
-
-        if Sxx.shape[1] > spec_dict['max_shape']:
-            spec_dict['max_shape'] = Sxx.shape[1]
-
-        short_name = wav_fname.split(sep='/')[-1]
-        file_digit = int(short_name.split(sep="_")[0])
-        speaker_index = int(short_name.split(sep="_")[1])
-
-        spec_dict['specs'][id] = {'spec': Sxx,
-                                  'digit': file_digit,
-                                  'speaker': speaker_index,
-                                  'shape': Sxx.shape[1],
-                                  'name': wav_fname}
-        id += 1
-    print("\nZero padding the spectrograms...")
-    max_row_length = spec_dict['max_shape']
-    for i, id in enumerate(spec_dict['specs'].keys()):
-        print_progress(i=i, len_filepaths=len_filepaths)
-        npad = ((0, 0), (0, max_row_length - spec_dict['specs'][id]['spec'].shape[1]))
-        spec_dict['specs'][id]['spec'] = np.pad(spec_dict['specs'][id]['spec'],
-                                                pad_width=npad,
-                                                mode='constant',
-                                                constant_values=(0)).flatten('C')
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        stack.enter_context(span('spectrogram creation', files=len_filepaths, n_jobs=n_jobs))
+        if n_jobs > 1:
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=n_jobs))
+            results = pool.map(partial(compute_spectrogram, cutoff_index=cutoff_index, dtype=dtype,
+                                       nperseg=nperseg, noverlap=noverlap), filepaths,
+                               chunksize=max(1, len_filepaths // (4 * n_jobs)))
+        else:
+            results = (compute_spectrogram(wav_fname, cutoff_index, dtype, nperseg, noverlap)
+                       for wav_fname in filepaths)
+        for i, (wav_fname, (f, t, Sxx)) in enumerate(zip(filepaths, results)):
+            print_progress(i=i, len_filepaths=len_filepaths)
+            if plot and i % 500 == 0:
+                from util import plot_spectrogram
+                plot_spectrogram(t, f, Sxx)
+
+            if Sxx.shape[1] > spec_dict['max_frames']:
+                spec_dict['max_frames'] = Sxx.shape[1]
+
+            file_digit, speaker_index = parse_filename(wav_fname)
+
+            spec_dict['specs'][id] = {'spec': Sxx,
+                                      'digit': file_digit,
+                                      'speaker': speaker_index,
+                                      'shape': Sxx.shape[1],
+                                      'name': wav_fname}
+            id += 1
+    elapsed = time.perf_counter() - start
+    print(f"\n{len_filepaths} files in {elapsed:.1f} s ({len_filepaths / max(elapsed, 1e-9):.1f} files/s)")
+    if time_layout == 'pad':
+        print("Zero padding the spectrograms...")
+        spec_dict['max_shape'] = spec_dict['max_frames']
+    else:
+        print(f"Resizing the spectrograms to {n_frames or 32} frames...")
+        spec_dict['max_shape'] = n_frames or 32
+    with span('padding', time_layout=time_layout):
+        for i, id in enumerate(spec_dict['specs'].keys()):
+            print_progress(i=i, len_filepaths=len_filepaths)
+            spec_dict['specs'][id]['spec'] = normalize_spectrogram(spec_dict['specs'][id]['spec'],
+                                                                   spec_dict['max_shape'], time_layout, log_magnitude,
+                                                                   n_bands)
+            count_bytes(spec_dict['specs'][id]['spec'])
     return spec_dict
 
 
-def stack_training(spec_dict, train_set, verbose=False):
+def stack_training(spec_dict, train_set, memmap_dir=None, delete_specs=False, verbose=False):
     """This function prepares the spectrogram dataset for the training SVD.
     It takes the spectrograms in spec_dict indixed by train_set.
     Then all the flattened spectrograms of a digit will be stacked column wise in an numpy nd.array.
     The 10 arrays are stored as values in a dictionary with the digits as keys.
 
+    The samples per digit are counted first, so every array is allocated once in Fortran order
+    and filled column by column in a single pass over train_set.
+
     Args:
         spec_dict (dict): The dictionary returned by create_all_spectrograms
         train_set (list): A list of indices corresponding to the training dataset as returned by sklearn train_test_split().
+        memmap_dir (string, optional): If given, the arrays are written to memory mapped .npy files
+            (stack_<digit>.npy) in this directory instead of being held in RAM. Defaults to None.
+        delete_specs (bool, optional): If True, the stacked spectrograms are deleted from spec_dict to save memory.
+            spec_dict can not be used for training again afterwards. Defaults to False.
+        verbose (bool, optional): If True, the progress will be printed every 500 samples. Defaults to False.
 
     Returns:
         dict: The dictionary containing digits (int) as keys and column-wise stacked nd.arrays as values.
@@ -128,25 +357,159 @@ def stack_training(spec_dict, train_set, verbose=False):
                             3: nd.array,
                             ...}
     """
-    train_stack = {}
-    digits = []
     print("Stacking spectrograms in preparation for SVD...")
-    for i, id in enumerate(train_set):
-        if verbose and i % 500 == 0:
-            print(i, end=" ")
-        digit = spec_dict['specs'][id]['digit']
-        if i == 0 or digit not in digits:
-            train_stack[digit] = spec_dict['specs'][id]['spec']
-            digits.append(digit)
-            del spec_dict['specs'][id]['spec']
-        else:
+    with span('stacking training', samples=len(train_set)):
+        counts = {}
+        for id in train_set:
+            digit = spec_dict['specs'][id]['digit']
+            counts[digit] = counts.get(digit, 0) + 1
+        n_features = spec_dict['specs'][train_set[0]]['spec'].size
+        dtype = spec_dict['specs'][train_set[0]]['spec'].dtype
+
+        train_stack = {}
+        for digit in sorted(counts):
+            shape = (n_features, counts[digit])
+            if memmap_dir is None:
+                train_stack[digit] = np.empty(shape, dtype=dtype, order='F')
+            else:
+                makedirs(memmap_dir, exist_ok=True)
+                train_stack[digit] = np.lib.format.open_memmap(path_join(memmap_dir, f"stack_{digit}.npy"),
+                                                               mode='w+', dtype=dtype, shape=shape,
+                                                               fortran_order=True)
+
+        columns = {digit: 0 for digit in counts}
+        for i, id in enumerate(train_set):
+            if verbose and i % 500 == 0:
+                print(i, end=" ")
             digit = spec_dict['specs'][id]['digit']
-            train_stack[digit] = np.column_stack((train_stack[digit], spec_dict['specs'][id]['spec']))
-            del spec_dict['specs'][id]['spec']
+            train_stack[digit][:, columns[digit]] = spec_dict['specs'][id]['spec']
+            columns[digit] += 1
+            if delete_specs:
+                del spec_dict['specs'][id]['spec']
+        if memmap_dir is not None:
+            for digit in train_stack:
+                train_stack[digit].flush()
+        count_bytes(*train_stack.values())
     print()
     return train_stack
 
 
+def stack_test(spec_dict, test_set):
+    """This function stacks the flattened spectrograms indexed by test_set column wise in one nd.array,
+    so the whole test set can be classified with matrix-matrix products.
+
+    Args:
+        spec_dict (dict): The dictionary returned by create_all_spectrograms
+        test_set (list): A list of indices corresponding to the test dataset as returned by sklearn train_test_split().
+
+    Returns:
+        nd.array: The test spectrograms with one column per entry in test_set.
+    """
+    with span('stacking test', samples=len(test_set)):
+        if 'matrix' in spec_dict:
+            rows = spec_dict['specs'].rows(test_set)
+            test_matrix = np.asfortranarray(spec_dict['matrix'][rows].T)
+        else:
+            first = spec_dict['specs'][test_set[0]]['spec']
+            test_matrix = np.empty((first.size, len(test_set)), dtype=first.dtype, order='F')
+            for i, id in enumerate(test_set):
+                test_matrix[:, i] = spec_dict['specs'][id]['spec']
+        count_bytes(test_matrix)
+    return test_matrix
+
+
+class SpecRecords(Mapping):
+    """Read-only view on a spectrogram store that behaves like spec_dict['specs'].
+    The entries are built on access, with 'spec' being a row of the memory mapped spectrogram matrix,
+    so only the rows that are actually used are paged in.
+    """
+
+    def __init__(self, matrix, ids, digits, speakers, shapes, names):
+        self.matrix = matrix
+        self.ids = ids
+        self.digits = digits
+        self.speakers = speakers
+        self.shapes = shapes
+        self.names = names
+        self._rows = {int(id): row for row, id in enumerate(ids)}
+
+    def __getitem__(self, id):
+        row = self._rows[id]
+        return {'spec': self.matrix[row],
+                'digit': int(self.digits[row]),
+                'speaker': int(self.speakers[row]),
+                'shape': int(self.shapes[row]),
+                'name': str(self.names[row])}
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def rows(self, ids):
+        """Returns the matrix rows of the given ids."""
+        return [self._rows[id] for id in ids]
+
+
+def save_spectrogram_store(spec_dict, store_dir):
+    """Writes a spec_dict as returned by create_all_spectrograms to a columnar store on disk.
+    The zero padded spectrograms are saved as one contiguous (n_samples x n_features) array,
+    the meta data of the files as one array per field and the dataset meta data as json.
+
+    Args:
+        spec_dict (dict): The dictionary returned by create_all_spectrograms
+        store_dir (string): Directory of the store. It will be created if it does not exist.
+    """
+    makedirs(store_dir, exist_ok=True)
+    ids = list(spec_dict['specs'].keys())
+    first = spec_dict['specs'][ids[0]]['spec']
+    matrix = np.lib.format.open_memmap(path_join(store_dir, "specs.npy"), mode='w+',
+                                       dtype=first.dtype, shape=(len(ids), first.size))
+    for row, id in enumerate(ids):
+        matrix[row] = spec_dict['specs'][id]['spec']
+    matrix.flush()
+    del matrix
+    np.save(path_join(store_dir, "ids.npy"), np.array(ids, dtype=np.int64))
+    for field, dtype in (('digit', np.int8), ('speaker', np.int16), ('shape', np.int32)):
+        np.save(path_join(store_dir, f"{field}s.npy"),
+                np.array([spec_dict['specs'][id][field] for id in ids], dtype=dtype))
+    np.save(path_join(store_dir, "names.npy"), np.array([spec_dict['specs'][id]['name'] for id in ids]))
+    meta = {key: value for key, value in spec_dict.items() if key not in ('specs', 'matrix')}
+    with open(path_join(store_dir, "meta.json"), 'w') as f:
+        json.dump(meta, f)
+
+
+def load_spectrogram_store(store_dir):
+    """Opens a store written by save_spectrogram_store.
+    The spectrogram matrix is memory mapped, so loading does not read the spectrograms.
+
+    Args:
+        store_dir (string): Directory of the store.
+
+    Returns:
+        dict: A dictionary structured like the one returned by create_all_spectrograms, where
+            spec_dict['specs'] is a SpecRecords view and spec_dict['matrix'] the memory mapped
+            (n_samples x n_features) spectrogram array.
+    """
+    with open(path_join(store_dir, "meta.json")) as f:
+        spec_dict = json.load(f)
+    matrix = np.load(path_join(store_dir, "specs.npy"), mmap_mode='r')
+    spec_dict['specs'] = SpecRecords(matrix=matrix,
+                                     ids=np.load(path_join(store_dir, "ids.npy")),
+                                     digits=np.load(path_join(store_dir, "digits.npy")),
+                                     speakers=np.load(path_join(store_dir, "speakers.npy")),
+                                     shapes=np.load(path_join(store_dir, "shapes.npy")),
+                                     names=np.load(path_join(store_dir, "names.npy")))
+    spec_dict['matrix'] = matrix
+    return spec_dict
+
+
+def is_spectrogram_store(store_dir):
+    """Returns True if store_dir contains a complete spectrogram store."""
+    return isfile(path_join(store_dir, "meta.json"))
+
+
 if __name__ == '__main__':
     path = "data"
     test_size = 0.25
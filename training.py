@@ -3,35 +3,345 @@
 @author: P.Schwarz
 """
 
+import time
+
 import numpy as np
-import pandas as pd
 from numpy import linalg
 
+from instrumentation import span, count_bytes
+
+
+def randomized_svd(matrix, k_max, oversampling=10, n_iter=2, random_seed=None):
+    """
+    Approximates the leading left singular vectors of a matrix with a randomized range finder.
+    The range of the matrix is sampled with a gaussian test matrix and refined by power iterations.
+    :param matrix: Matrix to decompose
+    :param k_max: Number of left singular vectors to compute
+    :param oversampling: Additional samples of the range to improve the approximation
+    :param n_iter: Number of power iterations
+    :param random_seed: Seed of the gaussian test matrix
+    :return: Approximated left singular vectors (n x k_max), approximated singular values
+    """
+    rng = np.random.default_rng(random_seed)
+    n_samples = min(k_max + oversampling, min(matrix.shape))
+    omega = rng.standard_normal((matrix.shape[1], n_samples)).astype(matrix.dtype, copy=False)
+    q, _ = linalg.qr(matrix @ omega)
+    for _ in range(n_iter):
+        q, _ = linalg.qr(matrix.T @ q)
+        q, _ = linalg.qr(matrix @ q)
+    u_b, s, _ = linalg.svd(q.T @ matrix, full_matrices=False)
+    return (q @ u_b[:, :k_max]), s[:k_max]
+
 
-def get_svd_path(goal, test_ratio, random_seed):
-    return "svd_" + goal + "_" + str(test_ratio) + "_" + str(random_seed)
+def gram_svd(matrix, k_max=None):
+    """
+    Calculates the leading left singular vectors of a tall matrix by the method of snapshots.
+    The small column Gram matrix X^T X is eigendecomposed and U is recovered as X V / s,
+    so the cost scales with the number of columns instead of the number of rows.
+    Forming X^T X squares the condition number, so singular values below about sqrt(max(shape) * eps) times the
+    largest one are noise. Their singular vectors are dropped, which keeps the returned columns orthonormal.
+    :param matrix: Matrix to decompose
+    :param k_max: Number of left singular vectors to compute. Defaults to all columns.
+    :return: Left singular vectors (n x k), singular values
+    """
+    eigenvalues, v = linalg.eigh(matrix.T @ matrix)
+    eigenvalues, v = eigenvalues[::-1], v[:, ::-1]
+    s = np.sqrt(np.clip(eigenvalues, 0, None))
+    tol = eigenvalues[0] * max(matrix.shape) * np.finfo(matrix.dtype).eps if s.size else 0
+    rank = int(np.count_nonzero(eigenvalues > tol))
+    if k_max is not None:
+        rank = min(rank, k_max)
+    u = (matrix @ v[:, :rank]) / s[:rank]
+    return u, s[:rank]
 
 
-def calc_svd(train_stack, subset_count, verbose=False):
+def update_svd(u, s, new_columns, k_max=None):
+    """
+    Updates a truncated SVD with new columns (Brand's rank-k update) without revisiting the old columns.
+    With Uk^T C = M and C - Uk M = Q R, the updated decomposition follows from the small SVD of
+    [[diag(s), M], [0, R]] = U' S' V'^T as [Uk Q] U' and S'.
+    :param u: Left singular vectors of the old data (n x k)
+    :param s: Singular values of the old data
+    :param new_columns: New data stacked column wise (n x c)
+    :param k_max: Number of singular vectors kept after the update. Defaults to k.
+    :return: updated left singular vectors, updated singular values
+    """
+    k = len(s)
+    u = u[:, :k]
+    if k_max is None:
+        k_max = k
+    m = u.T @ new_columns
+    q, r = linalg.qr(new_columns - u @ m)
+    middle = np.zeros((k + r.shape[0], k + new_columns.shape[1]), dtype=np.result_type(m, r))
+    middle[:k, :k] = np.diag(s)
+    middle[:k, k:] = m
+    middle[k:, k:] = r
+    u_middle, s_new, _ = linalg.svd(middle, full_matrices=False)
+    u_new = np.hstack((u, q)) @ u_middle[:, :k_max]
+    return u_new.astype(u.dtype, copy=False), s_new[:k_max]
+
+
+def subspace_drift(u_a, u_b, k):
+    """
+    Measures the distance of the subspaces spanned by the first k columns of two bases.
+    :param u_a: First basis
+    :param u_b: Second basis
+    :param k: Number of columns compared
+    :return: sine of the largest principal angle, 0 for identical and 1 for orthogonal subspaces
+    """
+    cosines = linalg.svd(u_a[:, :k].T @ u_b[:, :k], compute_uv=False)
+    return float(np.sqrt(max(0.0, 1 - min(cosines.min(), 1.0) ** 2)))
+
+
+def choose_svd_method(matrix, gram_ratio=4):
+    """
+    Selects the SVD backend by the aspect ratio of a training stack.
+    :param matrix: Training stack of one class
+    :param gram_ratio: Minimal ratio of rows to columns for which the Gram matrix method is used
+    :return: 'gram' for tall and narrow matrices, otherwise 'economy'
+    """
+    rows, columns = matrix.shape
+    return 'gram' if rows >= gram_ratio * columns else 'economy'
+
+
+def calc_svd(train_stack, subset_count, method='full', k_max=None, oversampling=10, n_iter=2,
+             random_seed=None, gram_ratio=4, dtype=None, return_singular_values=False, verbose=False):
     """
     Calculates the singular value decomposition for the given training data
 
     :param train_stack: Training data
     :param subset_count: Number of classes the data will be divided in
+    :param method: 'full' computes the complete U, 'economy' the thin SVD and 'randomized' only
+        approximates the leading k_max left singular vectors with a randomized range finder.
+        'gram' eigendecomposes the column Gram matrix and 'auto' chooses between 'gram' and 'economy'
+        per class by the aspect ratio of the stack.
+    :param k_max: If given, only the first k_max left singular vectors are stored per class.
+        Classes with less than k_max singular vectors, e.g. with less training samples than k_max, are padded
+        with zero columns, so every class is scored with the same rank. The zero columns do not change any residual.
+    :param oversampling: Oversampling of the randomized range finder
+    :param n_iter: Number of power iterations of the randomized range finder
+    :param random_seed: Seed of the randomized range finder
+    :param gram_ratio: Minimal ratio of rows to columns for which 'auto' uses the Gram matrix method
+    :param dtype: Data type the SVD is computed and stored in. Defaults to the data type of the training data.
+    :param return_singular_values: If true, the singular values of every subset are returned as well.
+        They are not padded, so their length is the true rank of the class basis without the zero columns.
     :param verbose: If true a console output will be generated for every subset calculation
-    :return: List of calculated SVDs
+    :return: List of calculated SVDs and, if return_singular_values is true, list of the singular values
     """
+    if method not in ('full', 'economy', 'randomized', 'gram', 'auto'):
+        raise ValueError(f"Unknown SVD method '{method}'.")
+    if method == 'randomized' and k_max is None:
+        raise ValueError("The randomized SVD needs k_max.")
     svd_list = []
+    sv_list = []
     if not verbose:
         print("Calculating SVD on training data...")
     for i in range(subset_count):
+        stack = train_stack[i] if dtype is None else train_stack[i].astype(dtype, copy=False)
+        subset_method = choose_svd_method(stack, gram_ratio) if method == 'auto' else method
         if verbose:
-            print("Calculating SVD of training data for subset ", i)
-        u, _, _ = linalg.svd(train_stack[i])
+            print("Calculating SVD of training data for subset ", i, "with method", subset_method)
+        with span('svd', subset=i, method=subset_method, shape=list(stack.shape)):
+            if subset_method == 'randomized':
+                u, s = randomized_svd(stack, k_max, oversampling=oversampling, n_iter=n_iter,
+                                      random_seed=random_seed)
+            elif subset_method == 'gram':
+                u, s = gram_svd(stack, k_max)
+            else:
+                u, s, _ = linalg.svd(stack, full_matrices=subset_method == 'full')
+            if k_max is not None:
+                u = np.ascontiguousarray(u[:, :k_max])
+                s = s[:k_max]
+            count_bytes(u, s)
         svd_list.append(u)
+        sv_list.append(s)
+    # all bases get the same width, as in the model file, so a trained and a loaded model classify alike
+    width = k_max if k_max is not None else max(u.shape[1] for u in svd_list)
+    for i, u in enumerate(svd_list):
+        if u.shape[1] < width:
+            padded = np.zeros((u.shape[0], width), dtype=u.dtype)
+            padded[:, :u.shape[1]] = u
+            svd_list[i] = padded
+    if return_singular_values:
+        return svd_list, sv_list
     return svd_list
 
 
+def classify_batch_sweep(svd_list, k_list, test_matrix, chunk_size=512, verbose=False):
+    """
+    Classifies a whole set of samples for several values of k at once.
+    Since the columns of U are orthonormal, ||x - Uk Uk^T x||^2 = ||x||^2 - ||Uk^T x||^2 and the projection
+    energies of all k are cumulative sums of the squared coefficients U^T x computed once for max(k_list).
+    :param svd_list: List with SVDs
+    :param k_list: Values of k to evaluate
+    :param test_matrix: Test samples stacked column wise (n_features x n_samples)
+    :param chunk_size: Number of samples per chunk. Bounds the memory of the intermediate products.
+    :param verbose: If true, a log output will be generated for every processed chunk
+    :return: dict with every k of k_list as key and (array of most likely digits, amount of SVs used,
+        residual matrix (n_samples x n_classes)) as value
+    """
+    # clamped to the narrowest basis, so every class is scored with the same rank
+    width = min(u.shape[1] for u in svd_list)
+    used_k = {k: min(k, width) for k in k_list}
+    k_max = max(used_k.values())
+    n_samples = test_matrix.shape[1]
+    with span('residuals', samples=n_samples, k=k_max, sweep=len(k_list)):
+        residuals = {k: np.empty((n_samples, len(svd_list))) for k in k_list}
+        count_bytes(*residuals.values())
+        for start in range(0, n_samples, chunk_size):
+            stop = min(start + chunk_size, n_samples)
+            if verbose:
+                print(f"\tCalculating residuals for samples {start} to {stop - 1}")
+            X = test_matrix[:, start:stop]
+            # the energies are accumulated in float64 to limit the cancellation of the difference
+            energy = np.einsum('ij,ij->j', X, X, dtype=np.float64)
+            for i in range(len(svd_list)):
+                projection_energy = np.cumsum((svd_list[i][:, :k_max].T @ X).astype(np.float64) ** 2, axis=0)
+                for k in k_list:
+                    residuals[k][start:stop, i] = np.sqrt(np.clip(energy - projection_energy[used_k[k] - 1], 0,
+                                                                  None))
+    return {k: (np.argmin(residuals[k], axis=1), used_k[k], residuals[k]) for k in k_list}
+
+
+def classify_cascade(svd_list, k, test_matrix, screen_rank=4, top_m=3, margin=0.05, actual_digits=None,
+                     chunk_size=512, verbose=False):
+    """
+    Classifies a whole set of samples in two stages. All classes are screened with the cheap residuals of their
+    first screen_rank basis vectors, then the rank-k residuals are only computed for the top_m candidate classes
+    of every sample. Samples whose screening residuals of the last candidate and the best pruned class differ by
+    less than the relative margin are evaluated against all classes.
+    Pruned classes keep their screening residual, which is an upper bound of their rank-k residual,
+    so the prediction is always one of the candidates.
+    :param svd_list: List with SVDs
+    :param k: number of singular values used in the calculation
+    :param test_matrix: Test samples stacked column wise (n_features x n_samples)
+    :param screen_rank: Number of basis vectors used in the screening
+    :param top_m: Number of candidate classes evaluated with rank k
+    :param margin: Relative margin below which a sample falls back to the evaluation of all classes
+    :param actual_digits: Optional actual digits to count how often the true class is pruned
+    :param chunk_size: Number of samples per chunk. Bounds the memory of the intermediate products.
+    :param verbose: If true, a log output will be generated for every processed chunk
+    :return: array of most likely digits, amount of SVs used, residual matrix (n_samples x n_classes), dict with
+        the fallback rate, the evaluated share of all rank-k residuals and the rate of pruned true classes
+    """
+    k = min(k, svd_list[0].shape[1])
+    screen_rank = min(screen_rank, k)
+    n_classes = len(svd_list)
+    n_samples = test_matrix.shape[1]
+    with span('residuals', samples=n_samples, k=k, screen_rank=screen_rank, top_m=top_m):
+        residuals = np.empty((n_samples, n_classes))
+        evaluated = np.zeros((n_samples, n_classes), dtype=bool)
+        fallback = np.zeros(n_samples, dtype=bool)
+        count_bytes(residuals, evaluated, fallback)
+        for start in range(0, n_samples, chunk_size):
+            stop = min(start + chunk_size, n_samples)
+            if verbose:
+                print(f"\tScreening samples {start} to {stop - 1}")
+            X = test_matrix[:, start:stop]
+            energy = np.einsum('ij,ij->j', X, X, dtype=np.float64)
+            for i in range(n_classes):
+                coefficients = (svd_list[i][:, :screen_rank].T @ X).astype(np.float64)
+                residuals[start:stop, i] = np.sqrt(np.clip(energy - np.einsum('ij,ij->j', coefficients, coefficients),
+                                                           0, None))
+            screened = residuals[start:stop]
+            if top_m < n_classes:
+                order = np.argsort(screened, axis=1)
+                ranked = np.take_along_axis(screened, order, axis=1)
+                gap = ((ranked[:, top_m] - ranked[:, top_m - 1])
+                       / np.maximum(ranked[:, top_m], np.finfo(np.float64).tiny))
+                fallback[start:stop] = gap < margin
+                np.put_along_axis(evaluated[start:stop], order[:, :top_m], True, axis=1)
+            else:
+                fallback[start:stop] = True
+            evaluated[start:stop][fallback[start:stop]] = True
+            for i in range(n_classes):
+                columns = np.flatnonzero(evaluated[start:stop, i])
+                if columns.size:
+                    Uk = svd_list[i][:, :k]
+                    Xi = X[:, columns]
+                    residuals[start + columns, i] = linalg.norm(Xi - Uk @ (Uk.T @ Xi), axis=0)
+    stats = {'fallback_rate': float(fallback.mean()),
+             'evaluated_fraction': float(evaluated.mean())}
+    if actual_digits is not None:
+        stats['true_class_pruned'] = float(np.mean(~evaluated[np.arange(n_samples), np.asarray(actual_digits)]))
+    return np.argmin(residuals, axis=1), k, residuals, stats
+
+
+def compare_cascade(svd_list, k, test_matrix, actual_digits, chunk_size=512, **kwargs):
+    """
+    Reports error rate, pruning statistics and speedup of the cascaded classification against classify_batch.
+    :param svd_list: List with SVDs
+    :param k: number of singular values used in the calculation
+    :param test_matrix: Test samples stacked column wise
+    :param actual_digits: Actual digit of every test sample
+    :param chunk_size: Number of samples per chunk
+    :param kwargs: Further arguments of classify_cascade
+    :return: dict with the error rates and durations of both classifications and the cascade statistics
+    """
+    actual_digits = np.asarray(actual_digits)
+    start = time.perf_counter()
+    full_pred, k, _ = classify_batch(svd_list, k, test_matrix, chunk_size=chunk_size)
+    full_duration = time.perf_counter() - start
+    start = time.perf_counter()
+    cascade_pred, _, _, stats = classify_cascade(svd_list, k, test_matrix, actual_digits=actual_digits,
+                                                 chunk_size=chunk_size, **kwargs)
+    cascade_duration = time.perf_counter() - start
+    comparison = dict(stats,
+                      error_rate_full=float(np.mean(full_pred != actual_digits)),
+                      error_rate_cascade=float(np.mean(cascade_pred != actual_digits)),
+                      speedup=full_duration / cascade_duration)
+    print(f"k={k}: error rate full {comparison['error_rate_full'] * 100:.2f} %, "
+          f"cascade {comparison['error_rate_cascade'] * 100:.2f} %, "
+          f"true class pruned {stats['true_class_pruned'] * 100:.2f} %, "
+          f"fallback {stats['fallback_rate'] * 100:.2f} %, speedup {comparison['speedup']:.2f}")
+    return comparison
+
+
+def compare_svd_methods(train_stack, test_matrix, actual_digits, k_list, method, k_max, **kwargs):
+    """
+    Reports the error rates of a truncated SVD method against the full SVD for every k.
+    :param train_stack: Training data
+    :param test_matrix: Test samples stacked column wise
+    :param actual_digits: Actual digit of every test sample
+    :param k_list: Values of k to compare
+    :param method: SVD method to compare against the full SVD
+    :param k_max: Number of left singular vectors of the truncated method
+    :param kwargs: Further arguments passed to calc_svd for the truncated method
+    :return: dict with the error rates of both methods for every k
+    """
+    actual_digits = np.asarray(actual_digits)
+    # the thin SVD has the same leading singular vectors as the full SVD
+    full_list = calc_svd(train_stack, 10, method='economy')
+    truncated_list = calc_svd(train_stack, 10, method=method, k_max=k_max, **kwargs)
+    comparison = {}
+    for k in k_list:
+        full_pred, _, _ = classify_batch(full_list, k, test_matrix)
+        truncated_pred, used_k, _ = classify_batch(truncated_list, k, test_matrix)
+        comparison[k] = {'full': float(np.mean(full_pred != actual_digits)),
+                         method: float(np.mean(truncated_pred != actual_digits))}
+        print(f"k={used_k}: error rate full SVD {comparison[k]['full'] * 100:.2f} %, "
+              f"{method} SVD {comparison[k][method] * 100:.2f} %")
+    return comparison
+
+
+def calc_residuals(svd_list, k, test_digit):
+    """
+    Calculates the residuals of a sample against every class basis.
+    The residual ||x - Uk Uk^T x|| is computed via the projection coefficients Uk^T x,
+    so no n x n projection matrix has to be built.
+    :param svd_list: List with SVDs
+    :param k: number of singular values used in the calculation
+    :param test_digit: test sample
+    :return: list with one residual per class
+    """
+    x = test_digit.flatten('C')
+    residuals = []
+    for i in range(len(svd_list)):
+        Uk = svd_list[i][:, :k]
+        residuals.append(linalg.norm(x - Uk @ (Uk.T @ x), 2))
+    return residuals
+
+
 def estimate_digit(svd_list, k, test_digit, verbose=False):
     """
     Classifies a sample by a given svd set to determine the most likely digit said in the sample
@@ -46,17 +356,75 @@ def estimate_digit(svd_list, k, test_digit, verbose=False):
         k = max_n_sv
     if verbose:
         print("\tCalculating residuals:", end=" ")
-    residuals = []
-    for i in range(10):
-        if verbose:
-            print(f"#{i}", end=" ")
-        test_digit = test_digit.flatten('C')
-        Uk = svd_list[i][:, :k]
-        residual = linalg.norm((np.identity(len(test_digit)) - Uk @ np.transpose(Uk)) @ test_digit, 2)
-        residuals.append(residual)
+    residuals = calc_residuals(svd_list, k, test_digit)
+    if verbose:
+        print(" ".join(f"#{i}" for i in range(len(residuals))))
     return residuals.index(min(residuals)), k, residuals
 
 
+def classify_batch(svd_list, k, test_matrix, chunk_size=512, verbose=False):
+    """
+    Classifies a whole set of samples at once. The samples are processed in chunks of columns,
+    so the residuals against every class basis are computed with matrix-matrix products.
+    :param svd_list: List with SVDs
+    :param k: number of singular values used in the calculation
+    :param test_matrix: Test samples stacked column wise (n_features x n_samples)
+    :param chunk_size: Number of samples per chunk. Bounds the memory of the intermediate products.
+    :param verbose: If true, a log output will be generated for every processed chunk
+    :return: array of most likely digits, amount of SVs used, residual matrix (n_samples x n_classes)
+    """
+    k = min(k, svd_list[0].shape[1])
+    n_samples = test_matrix.shape[1]
+    with span('residuals', samples=n_samples, k=k):
+        residuals = np.empty((n_samples, len(svd_list)))
+        count_bytes(residuals)
+        for start in range(0, n_samples, chunk_size):
+            stop = min(start + chunk_size, n_samples)
+            if verbose:
+                print(f"\tCalculating residuals for samples {start} to {stop - 1}")
+            X = test_matrix[:, start:stop]
+            for i in range(len(svd_list)):
+                Uk = svd_list[i][:, :k]
+                residuals[start:stop, i] = linalg.norm(X - Uk @ (Uk.T @ X), axis=0)
+    return np.argmin(residuals, axis=1), k, residuals
+
+
+def compare_dtypes(train_stack, test_matrix, actual_digits, k_list, method='economy', k_max=None):
+    """
+    Reports the error rates and run times of training and classification in float32 against float64.
+    The given training and test data are cast to both data types, the spectrograms themselves are not recomputed.
+    For float32 features, the float64 run therefore only measures the SVD and classification in float64 and
+    not the quantization of the spectrograms. Compute the features with dtype='float64' for a full reference.
+    :param train_stack: Training data
+    :param test_matrix: Test samples stacked column wise
+    :param actual_digits: Actual digit of every test sample
+    :param k_list: Values of k to compare
+    :param method: SVD method used in training
+    :param k_max: Number of left singular vectors stored per class
+    :return: dict with the error rate for every k and the run time of both data types and the data type of the
+        given features
+    """
+    actual_digits = np.asarray(actual_digits)
+    feature_dtype = np.result_type(test_matrix, *train_stack.values()).name
+    if feature_dtype != 'float64':
+        print(f"Note: the features are {feature_dtype}, the float64 run uses them upcast, "
+              f"so it does not show the error of the {feature_dtype} spectrograms.")
+    comparison = {'feature_dtype': feature_dtype}
+    for dtype in (np.float64, np.float32):
+        name = np.dtype(dtype).name
+        start = time.perf_counter()
+        svd_list = calc_svd(train_stack, 10, method=method, k_max=k_max, dtype=dtype)
+        results = classify_batch_sweep(svd_list, k_list, test_matrix.astype(dtype, copy=False))
+        comparison[name] = {'duration': time.perf_counter() - start,
+                            'error_rates': {k: float(np.mean(results[k][0] != actual_digits)) for k in k_list}}
+    for k in k_list:
+        print(f"k={k}: error rate float64 {comparison['float64']['error_rates'][k] * 100:.2f} %, "
+              f"float32 {comparison['float32']['error_rates'][k] * 100:.2f} %")
+    print(f"Duration float64 {comparison['float64']['duration']:.2f} s, float32 {comparison['float32']['duration']:.2f} s, "
+          f"speedup {comparison['float64']['duration'] / comparison['float32']['duration']:.2f}")
+    return comparison
+
+
 def filter_dataset(data, filter_key):
     """
     Filters given dataset by a given key and return the indices of filtered entries.
@@ -64,6 +432,7 @@ def filter_dataset(data, filter_key):
     :param filter_key: Key from the given dict
     :return: dict with indices assigned to every unique value of the given filter key
     """
+    import pandas as pd
     df = pd.DataFrame.from_dict(data, orient='index')
     print(df)
     keys = df[filter_key].unique()
@@ -72,3 +441,63 @@ def filter_dataset(data, filter_key):
         indices = df.index[df[filter_key] == k].tolist()
         filtered_data[k] = indices
     return filtered_data
+
+
+if __name__ == '__main__':
+    # Numeric equivalence check of the projection based residuals against (I - Uk Uk^T) x
+    rng = np.random.default_rng(42)
+    n, k = 320, 12
+    svd_list = [linalg.svd(rng.standard_normal((n, 40)))[0] for _ in range(10)]
+    sample = rng.standard_normal(n)
+    reference = [linalg.norm((np.identity(n) - u[:, :k] @ np.transpose(u[:, :k])) @ sample, 2) for u in svd_list]
+    digit, _, residuals = estimate_digit(svd_list, k, sample)
+    assert np.allclose(residuals, reference, rtol=1e-10, atol=1e-12)
+    assert digit == reference.index(min(reference))
+    digits, _, residual_matrix = classify_batch(svd_list, k, np.column_stack((sample, sample)), chunk_size=1)
+    assert np.allclose(residual_matrix, [reference, reference], rtol=1e-10, atol=1e-12)
+    sweep = classify_batch_sweep(svd_list, [1, k], sample[:, np.newaxis])
+    assert np.allclose(sweep[k][2], [reference], rtol=1e-8)
+    print("Residuals match the identity-matrix formula.")
+
+    # The Gram matrix backend spans the same leading subspaces as the thin SVD
+    stack = rng.standard_normal((n, 40)) @ np.diag(np.linspace(10, 1, 40))
+    u_gram, s_gram = gram_svd(stack, k)
+    u_thin, s_thin, _ = linalg.svd(stack, full_matrices=False)
+    assert np.allclose(s_gram, s_thin[:k])
+    assert np.allclose(np.abs(u_gram.T @ u_thin[:, :k]), np.identity(k), atol=1e-6)
+    print("Gram matrix SVD matches the thin SVD.")
+
+    # Singular values decaying to 1e-12 are below the accuracy of the Gram matrix, their vectors are dropped
+    left, _ = linalg.qr(rng.standard_normal((1500, 200)))
+    right, _ = linalg.qr(rng.standard_normal((200, 200)))
+    u_gram, _ = gram_svd((left * np.logspace(0, -12, 200)) @ right.T)
+    assert u_gram.shape[1] < 200
+    assert np.allclose(u_gram.T @ u_gram, np.identity(u_gram.shape[1]), atol=1e-4)
+    print("Gram matrix SVD of an ill-conditioned matrix is orthonormal.")
+
+    # Updating the SVD of the first 30 columns with the last 10 gives the SVD of all 40 columns
+    u_old, s_old, _ = linalg.svd(stack[:, :30], full_matrices=False)
+    u_new, s_new = update_svd(u_old, s_old, stack[:, 30:], k_max=k)
+    assert np.allclose(s_new, s_thin[:k])
+    assert subspace_drift(u_new, u_thin, k) < 1e-6
+    print("Incremental SVD update matches the thin SVD.")
+
+    # Without pruning, the cascade evaluates every class and equals the batch classification
+    test_matrix = rng.standard_normal((n, 25))
+    digits, _, residual_matrix = classify_batch(svd_list, k, test_matrix)
+    cascade_digits, _, cascade_residuals, _ = classify_cascade(svd_list, k, test_matrix, top_m=10)
+    assert np.array_equal(digits, cascade_digits) and np.allclose(residual_matrix, cascade_residuals)
+    print("Cascade without pruning matches the batch classification.")
+
+    # Classes with less training samples than k_max are padded, so the sweep can use every k up to k_max
+    uneven_stack = {i: rng.standard_normal((n, 50 - 4 * i)) for i in range(10)}
+    uneven_list, uneven_sv = calc_svd(uneven_stack, 10, method='economy', k_max=50, return_singular_values=True)
+    assert {u.shape[1] for u in uneven_list} == {50}
+    assert [len(s) for s in uneven_sv] == [50 - 4 * i for i in range(10)]
+    sweep = classify_batch_sweep(uneven_list, [10, 45, 50], test_matrix)
+    for k in (10, 45, 50):
+        digits, _, residual_matrix = classify_batch(uneven_list, k, test_matrix)
+        assert np.array_equal(sweep[k][0], digits) and np.allclose(sweep[k][2], residual_matrix, rtol=1e-6)
+    sweep = classify_batch_sweep([u[:, :u.shape[1] - i] for i, u in enumerate(uneven_list)], [50], test_matrix)
+    assert sweep[50][1] == 41
+    print("Sweep with uneven class sizes matches the batch classification.")
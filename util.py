@@ -4,19 +4,34 @@
 """
 
 import os
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import tracemalloc
 import numpy as np
 import json
-import pandas as pd
-from itertools import product
-from sklearn.metrics import ConfusionMatrixDisplay
-from matplotlib.backends.backend_pdf import PdfPages
 
+# matplotlib, pandas and sklearn are only imported when the first plot is made, see import_plotting()
+mpl = None
+plt = None
+pd = None
+ConfusionMatrixDisplay = None
+PdfPages = None
 
-mpl.rcParams['mathtext.fontset'] = 'stix'
-mpl.rcParams['font.family'] = 'STIXGeneral'
+
+def import_plotting():
+    """
+    Imports the plotting and reporting libraries on first use and sets the STIX font.
+    The classifier and the predictor do not pay for these imports unless plots are made.
+    """
+    global mpl, plt, pd, ConfusionMatrixDisplay, PdfPages
+    if plt is not None:
+        return
+    import matplotlib
+    import matplotlib.pyplot
+    import pandas
+    from sklearn.metrics import ConfusionMatrixDisplay as Display
+    from matplotlib.backends.backend_pdf import PdfPages as Pages
+    matplotlib.rcParams['mathtext.fontset'] = 'stix'
+    matplotlib.rcParams['font.family'] = 'STIXGeneral'
+    mpl, plt, pd, ConfusionMatrixDisplay, PdfPages = matplotlib, matplotlib.pyplot, pandas, Display, Pages
 
 
 def tracking_start():
@@ -57,6 +72,7 @@ def plot_spectrogram(t, f, Sxx):
 
     """
     os.makedirs(os.path.join(os.getcwd(), "plots"), exist_ok=True)
+    import_plotting()
     fig = plt.figure()
     plt.pcolormesh(t, f, Sxx, shading='gouraud')
     plt.ylabel('Frequency [Hz]')
@@ -77,6 +93,7 @@ def plot_graph(data, title, xlabel='Test Samples', ylabel='Error Rate', ylim=Non
     :param ground: If true, vertical axis will start at zero
     """
     os.makedirs(os.path.join(os.getcwd(), "plots"), exist_ok=True)
+    import_plotting()
     n = np.arange(0, np.size(data))
     fig = plt.figure(dpi=300)
     plt.plot(n, data)
@@ -99,6 +116,7 @@ def plot_multiline_graph(data, title):
     :param title: Title of the diagram
     """
     os.makedirs(os.path.join(os.getcwd(), "plots"), exist_ok=True)
+    import_plotting()
     keys = list(data.keys())
     n = np.arange(0, np.size(data[keys[0]]))
     fig = plt.figure(dpi=300)
@@ -127,22 +145,76 @@ def generate_random_plot_data(data):
     return data
 
 
+def result_arrays(data):
+    """Collects the results of a test run in arrays.
+
+    Args:
+        data (dict): Results dictionary as generated by digit_classifer() or loaded from its json reports,
+            or an evaluation dict with the arrays 'actual', 'estimated' and 'residuals'.
+
+    Returns:
+        tuple: actual digits, estimated digits and the residual matrix (n_samples x n_classes)
+    """
+    if 'results' not in data:
+        return np.asarray(data['actual']), np.asarray(data['estimated']), np.asarray(data['residuals'], dtype=float)
+    results = list(data['results'].values())
+    actual = np.fromiter((result['actual'] for result in results), dtype=int, count=len(results))
+    estimated = np.fromiter((result['estimated'] for result in results), dtype=int, count=len(results))
+    residuals = np.array([result['residuals'] for result in results], dtype=float).reshape(len(results), -1)
+    return actual, estimated, residuals
+
+
+def grouped_boxplot_stats(actual, values, n_classes=10, whis=1.5, fliers=False):
+    """Calculates the boxplot statistics of every tested basis for every actual digit class,
+    with the same quartiles and whiskers as matplotlib's boxplot.
+
+    Args:
+        actual (nd.array): Actual digit of every sample.
+        values (nd.array): Values to summarize, one row per sample and one column per tested basis.
+        n_classes (int, optional): Number of digit classes. Defaults to 10.
+        whis (float, optional): Whisker length in interquartile ranges. Defaults to 1.5.
+        fliers (bool, optional): If True, the values outside the whiskers are collected as well. Defaults to False.
+
+    Returns:
+        dict: digit classes as keys and lists of one statistics dict per tested basis as values,
+            ready to be drawn with ax.bxp(). Classes without samples have an empty list.
+    """
+    order = np.argsort(actual, kind='stable')
+    sorted_values = values[order]
+    bounds = np.searchsorted(actual[order], np.arange(n_classes + 1))
+    stats = {}
+    for digit_class in range(n_classes):
+        group = sorted_values[bounds[digit_class]:bounds[digit_class + 1]]
+        if len(group) == 0:
+            stats[digit_class] = []
+            continue
+        q1, med, q3 = np.percentile(group, [25, 50, 75], axis=0)
+        iqr = q3 - q1
+        inside_low = group >= q1 - whis * iqr
+        inside_high = group <= q3 + whis * iqr
+        whislo = np.minimum(np.where(inside_low, group, np.inf).min(axis=0), q1)
+        whishi = np.maximum(np.where(inside_high, group, -np.inf).max(axis=0), q3)
+        outside = ~(inside_low & inside_high)
+        stats[digit_class] = [{'med': med[basis], 'q1': q1[basis], 'q3': q3[basis],
+                               'whislo': whislo[basis], 'whishi': whishi[basis],
+                               'fliers': group[outside[:, basis], basis] if fliers else np.empty(0)}
+                              for basis in range(values.shape[1])]
+    return stats
+
+
 def plot_confusion_matrix(data, savestring=""):
     """Wrapper function for sklearn's ConfusionMatrixDisplay.
     The input dictionary will be used to plot a row-normalized confusion Matrix.
     It will help exploring errors over classes. The matrix is saved as a pdf files.
 
     Args:
-        data (dict): Results dictionary as generated by digit_classifer().
+        data (dict): Results dictionary as generated by digit_classifer() or an evaluation dict.
         savestring (str, optional): Additional info to pass to the diagrams filename. Defaults to "".
     """
 
     os.makedirs(os.path.join(os.getcwd(), "plots"), exist_ok=True)
-    y_true = []
-    y_pred = []
-    for k in data['results'].keys():
-        y_true.append(data['results'][k]['actual'])
-        y_pred.append(data['results'][k]['estimated'])
+    import_plotting()
+    y_true, y_pred, _ = result_arrays(data)
     cm = ConfusionMatrixDisplay.from_predictions(y_true=y_true, y_pred=y_pred,
                                                  labels=list(range(10)),
                                                  normalize='true')
@@ -155,33 +227,52 @@ def plot_confusion_matrix(data, savestring=""):
     del ax
 
 
-def plot_residuals(data, savestring=""):
-    os.makedirs(os.path.join(os.getcwd(), "plots"), exist_ok=True)
+def plot_residuals(data, savestring="", density=None, bins=100):
     """A function to make subplots of residuals over base digits for every actual digit class.
     Plot inspired by Elden.
-    Resulting plot will be saved as a PNG-file.
+    Resulting plot will be saved as a PDF-file.
     Take this module's boxplot_residuals() to get statistically more useful plots.
 
+    The residuals of a class are drawn as one LineCollection instead of one line per sample.
+    For large test sets, the lines are replaced by a density image: the residuals of every tested basis
+    are counted in logarithmic bins and every column is normalized to its maximum.
+
     Args:
-        data (dict): A dict where the classification results are stored.
+        data (dict): A dict where the classification results are stored, see result_arrays().
         savestring (str, optional): Additional string with metadata to pass to save-filename. Defaults to "".
+        density (bool, optional): If True, a density image is drawn instead of lines.
+            Defaults to True for more than 20000 samples.
+        bins (int, optional): Number of logarithmic residual bins of the density image. Defaults to 100.
     """
-    residuals_per_digit = {}
-    for i in range(10):
-        residuals_per_digit[str(i)] = []
-    for id in data['results'].keys():
-        k = str(data['results'][id]['actual'])
-        residuals_per_digit[k].append(list(data['results'][id]['residuals']))
+    os.makedirs(os.path.join(os.getcwd(), "plots"), exist_ok=True)
+    import_plotting()
+    from matplotlib.collections import LineCollection
+    actual, _, residuals = result_arrays(data)
+    if density is None:
+        density = len(residuals) > 20000
+    bases = np.arange(residuals.shape[1])
+    positive = residuals[residuals > 0]
+    edges = np.logspace(np.log10(positive.min()), np.log10(positive.max()), bins + 1)
 
     fig, axs = plt.subplots(2, 5, figsize=(10, 5), dpi=300, sharey=True)
     # plt.suptitle("Residuals vs. tested basis for every actual Digit.", fontsize=18, y=0.95)
     for i, ax in enumerate(axs.flat):
-        for residual_list in residuals_per_digit[str(i)]:
-            ax.semilogy(list(range(10)), residual_list, 'k', alpha=0.04)
+        class_residuals = residuals[actual == i]
+        if density:
+            rows = np.clip(np.searchsorted(edges, class_residuals, side='right') - 1, 0, bins - 1)
+            counts = np.bincount((rows * len(bases) + bases).ravel(), minlength=bins * len(bases))
+            counts = counts.reshape(bins, len(bases)).astype(float)
+            counts /= np.maximum(counts.max(axis=0), 1)
+            ax.pcolormesh(np.append(bases, len(bases)) - 0.5, edges, counts, cmap='Greys', shading='flat')
+        else:
+            segments = np.stack(np.broadcast_arrays(bases, class_residuals), axis=-1)
+            ax.add_collection(LineCollection(segments, colors='k', alpha=0.04))
+        ax.set_yscale('log')
         ax.set(xlabel='Tested Basis', ylabel='$\log_{2}(Residual)$')
         ax.set_title(f"Digit Class {str(i)}")
         ax.label_outer()
-    plt.setp(axs, xticks=list(range(10)), xticklabels=list(range(10)))
+    axs.flat[0].set_ylim(edges[0], edges[-1])
+    plt.setp(axs, xticks=list(range(10)), xticklabels=list(range(10)), xlim=(-0.5, 9.5) if density else (0, 9))
     plt.tight_layout(rect=[0, 0.03, 0.9, 0.9])
     plt.savefig(f"plots/residualplot_{savestring}.pdf", format="pdf", bbox_inches="tight")
     plt.close(fig)
@@ -189,40 +280,32 @@ def plot_residuals(data, savestring=""):
 
 def boxplot_residuals(data, savestring=""):
     """A function to make subplots of residuals over base digits for every actual digit class.
-    Resulting plot will be saved as a PNG-file.
+    Resulting plot will be saved as a PDF-file.
 
     Args:
-        data (dict): A dict where the classification results are stored.
+        data (dict): A dict where the classification results are stored, see result_arrays().
         savestring (str, optional): Additional string with metadata to pass to save-filename. Defaults to "".
 
-    The first few lines are needed to transfor data from corresponding to the test sample
-    to corresponding to a hierarchy of actual digit classes instead.
-    This is what we are actually interested in here since we want to plot statistical information for every digit class.
-    The dict from json data is converted to a pandas DataFrame oriented with test samples as rows.
-    The dataframe has collected residuals per test as a list in every field of column 'residuals'. This has to be split.
-    We split the lists of residuals to new columns such that one column corresponds to a tested base.
-    df[list(range(10))] just creates 10 columns with digits as names.
-    We furthermore just index the dataframe efficiently such that we get columns as pandas series and can convert them to lists.
-    We want to plot the boxplots by iterating through a dict. Lets call it box_dict.
-    It's keys (digit_class) refer to the actual digit classes. Each value is a list of 10 arrays,
-    each array consisting of all residuals for one combination of digit class and tested base
+    The residuals are collected in one (n_samples x 10) array with one column per tested base.
     We apply log2() on the array values to handle outliers.
+    The boxplot statistics of every combination of actual digit class and tested base are computed
+    at once per class with grouped_boxplot_stats() and drawn with ax.bxp(), so matplotlib does not
+    have to see the single residuals.
     The x-labels have to be constructed with
         [""] + [str(i) for i in range(10)] + [""]
     because the boxplots need the positions 0 and 11 as xticks.
     """
     os.makedirs(os.path.join(os.getcwd(), "plots"), exist_ok=True)
-    df = pd.DataFrame.from_dict(data['results'], orient='index')
-    df[list(range(10))] = pd.DataFrame(df.residuals.tolist(), index=df.index)
-    box_dict = {digit_class: [] for digit_class in range(10)}
-    for (digit_class, test_base) in product(range(10), range(10)):
-        box_dict[digit_class].append(np.log2(df[test_base].loc[df['actual'] == digit_class].to_list()))
+    import_plotting()
+    actual, _, residuals = result_arrays(data)
+    box_dict = grouped_boxplot_stats(actual, np.log2(residuals))
 
     x_labels = [""] + [str(i) for i in range(10)] + [""]
     fig, axs = plt.subplots(2, 5, figsize=(10, 5), dpi=300, sharey=True)
     # plt.suptitle("Boxplot of residuals vs. tested basis for every actual digit.", fontsize=18, y=0.95)
     for i, ax in enumerate(axs.flat):
-        ax.boxplot(box_dict[i], showfliers=False)
+        if box_dict[i]:
+            ax.bxp(box_dict[i], showfliers=False)
         ax.set(xlabel='Tested Basis', ylabel='$\log_{2}(Residual)$')
         ax.set_title(f"Digit Class {str(i)}")
         ax.label_outer()
@@ -236,81 +319,35 @@ def boxplot_residuals(data, savestring=""):
 
 def boxplot_residuals_multipage(data, savestring=""):
     """A function to make subplots of residuals over base digits for every actual digit class.
-    Resulting plot will be saved as a PNG-file.
+    Resulting plots will be saved to a multipage PDF-file with three digit classes per page.
 
     Args:
-        data (dict): A dict where the classification results are stored.
+        data (dict): A dict where the classification results are stored, see result_arrays().
         savestring (str, optional): Additional string with metadata to pass to save-filename. Defaults to "".
 
-    The first few lines are needed to transfor data from corresponding to the test sample
-    to corresponding to a hierarchy of actual digit classes instead.
-    This is what we are actually interested in here since we want to plot statistical information for every digit class.
-    The dict from json data is converted to a pandas DataFrame oriented with test samples as rows.
-    The dataframe has collected residuals per test as a list in every field of column 'residuals'. This has to be split.
-    We split the lists of residuals to new columns such that one column corresponds to a tested base.
-    df[list(range(10))] just creates 10 columns with digits as names.
-    We furthermore just index the dataframe efficiently such that we get columns as pandas series and can convert them to lists.
-    We want to plot the boxplots by iterating through a dict. Lets call it box_dict.
-    It's keys (digit_class) refer to the actual digit classes. Each value is a list of 10 arrays,
-    each array consisting of all residuals for one combination of digit class and tested base
-    We apply log2() on the array values to handle outliers.
-    The x-labels have to be constructed with
-        [""] + [str(i) for i in range(10)] + [""]
-    because the boxplots need the positions 0 and 11 as xticks.
+    The boxplot statistics including the outliers are computed as in boxplot_residuals().
     """
-    os.makedirs(os.path.join(os.getcwd(), "plots"), exist_ok=True)
-    df = pd.DataFrame.from_dict(data['results'], orient='index')
-    df[list(range(10))] = pd.DataFrame(df.residuals.tolist(), index=df.index)
-    box_dict = {digit_class: [] for digit_class in range(10)}
-    for (digit_class, test_base) in product(range(10), range(10)):
-        box_dict[digit_class].append(np.log2(df[test_base].loc[df['actual'] == digit_class].to_list()))
+    import_plotting()
+    actual, _, residuals = result_arrays(data)
+    box_dict = grouped_boxplot_stats(actual, np.log2(residuals), fliers=True)
 
     x_labels = [""] + [str(i) for i in range(10)] + [""]
 
     with PdfPages('multipage_pdf.pdf') as pdf:
-        fig, axs = plt.subplots(3, 1, figsize=(4.7, 7.5), dpi=300, sharey=True)
-        # plt.suptitle("Boxplot of residuals vs. tested basis for every actual digit.", fontsize=18, y=0.95)
-        for i, ax in zip(range(0, 3), axs.flat):
-            ax.boxplot(box_dict[i])
-            ax.set(xlabel='Tested Basis', ylabel='$\log_{10}(Residual)$')
-            ax.set_title(f"Actual Digit {str(i)}")
-        plt.setp(axs, xticks=list(range(12)), xticklabels=x_labels)
-        plt.tight_layout(rect=[0, 0.03, 1, 0.95])
-        pdf.savefig(fig)  # f"plots/residual_boxplots_{savestring}.pdf", format="pdf", bbox_inches="tight")
-        plt.close(fig)
-
-        fig, axs = plt.subplots(3, 1, figsize=(4.7, 7.5), dpi=300, sharey=True)
-        # plt.suptitle("Boxplot of residuals vs. tested basis for every actual digit.", fontsize=18, y=0.95)
-        for i, ax in zip(range(3, 6), axs.flat):
-            ax.boxplot(box_dict[i])
-            ax.set(xlabel='Tested Basis', ylabel='$\log_{10}(Residual)$')
-            ax.set_title(f"Actual Digit {str(i)}")
-        plt.setp(axs, xticks=list(range(12)), xticklabels=x_labels)
-        plt.tight_layout(rect=[0, 0.03, 1, 0.95])
-        pdf.savefig(fig)  # f"plots/residual_boxplots_{savestring}.pdf", format="pdf", bbox_inches="tight")
-        plt.close(fig)
-
-        fig, axs = plt.subplots(3, 1, figsize=(4.7, 7.5), dpi=300, sharey=True)
-        # plt.suptitle("Boxplot of residuals vs. tested basis for every actual digit.", fontsize=18, y=0.95)
-        for i, ax in zip(range(6, 9), axs.flat):
-            ax.boxplot(box_dict[i])
-            ax.set(xlabel='Tested Basis', ylabel='$\log_{10}(Residual)$')
-            ax.set_title(f"Actual Digit {str(i)}")
-        plt.setp(axs, xticks=list(range(12)), xticklabels=x_labels)
-        plt.tight_layout(rect=[0, 0.03, 1, 0.95])
-        pdf.savefig(fig)  # f"plots/residual_boxplots_{savestring}.pdf", format="pdf", bbox_inches="tight")
-        plt.close(fig)
-
-        fig, ax = plt.subplots(1, 1, figsize=(4.7, 2.5), dpi=300, sharey=True)
-        # plt.suptitle("Boxplot of residuals vs. tested basis for every actual digit.", fontsize=18, y=0.95)
-        i = 9
-        ax.boxplot(box_dict[i])
-        ax.set(xlabel='Tested Basis', ylabel='$\log_{10}(Residual)$')
-        ax.set_title(f"Actual Digit {str(i)}")
-        plt.setp(axs, xticks=list(range(12)), xticklabels=x_labels)
-        plt.tight_layout(rect=[0, 0.03, 1, 0.95])
-        pdf.savefig(fig)  # f"plots/residual_boxplots_{savestring}.pdf", format="pdf", bbox_inches="tight")
-        plt.close(fig)
+        for digit_classes in (range(0, 3), range(3, 6), range(6, 9), range(9, 10)):
+            height = 7.5 if len(digit_classes) == 3 else 2.5
+            fig, axs = plt.subplots(len(digit_classes), 1, figsize=(4.7, height), dpi=300, sharey=True,
+                                    squeeze=False)
+            # plt.suptitle("Boxplot of residuals vs. tested basis for every actual digit.", fontsize=18, y=0.95)
+            for i, ax in zip(digit_classes, axs.flat):
+                if box_dict[i]:
+                    ax.bxp(box_dict[i])
+                ax.set(xlabel='Tested Basis', ylabel='$\log_{10}(Residual)$')
+                ax.set_title(f"Actual Digit {str(i)}")
+            plt.setp(axs, xticks=list(range(12)), xticklabels=x_labels)
+            plt.tight_layout(rect=[0, 0.03, 1, 0.95])
+            pdf.savefig(fig)  # f"plots/residual_boxplots_{savestring}.pdf", format="pdf", bbox_inches="tight")
+            plt.close(fig)
 
 
 if __name__ == '__main__':